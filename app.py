@@ -1,20 +1,104 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, stream_with_context, send_file, g
+from flask import before_render_template, template_rendered, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import click
+import codecs
+import csv
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import logging
+import mimetypes
 import os
+import pickle
+import socket
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'university_secret_key_123'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads/medical_reports'
+app.config['IMPORT_FOLDER'] = 'uploads/imports'  # CSV files waiting for (or resuming) a background import
+app.config['ARCHIVE_FOLDER'] = os.environ.get('ARCHIVE_FOLDER', 'archives')  # read-only files of closed semesters
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'  # let the front-end server send documents
 ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'doc', 'docx'}
 
-# Create upload folder if it doesn't exist
+# --- Database Engine ---
+# SQLite connections are tuned for many concurrent readers and short write bursts (WAL);
+# server databases get a pre-pinged connection pool. Everything can be overridden from the environment.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 15000)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),  # negative = KiB, so 64MB
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'foreign_keys': 'ON',
+}
+
+if make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'sqlite':
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'connect_args': {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000},
+    }
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DATABASE_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+
+# Create upload folders if they don't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['IMPORT_FOLDER'], exist_ok=True)
+os.makedirs(app.config['ARCHIVE_FOLDER'], exist_ok=True)
+
+# Seed for the course table of a new database: (code, name, lecturer)
+DEFAULT_COURSES = [
+    ('NANO2112', 'Mathematics for Nano Science Technology I', 'Dr. (Ms.) Chathurangani Karunarathna'),
+    ('NANO2122', 'Fundamentals of Nano-Electronics', 'Dr. Asanka Rajapaksha'),
+    ('NANO2132', 'Digital Electronics', 'Dr. (Ms.) Upeka Samarakoon'),
+    ('NANO2142', 'Introduction to Software Development', 'Dr. Upanith Liyanaarachchi'),
+    ('NANO2151', 'Principles of Material Science Engineering', 'Dr. (Ms.) Chathurangani Karunarathna'),
+    ('NANO2162', 'Engineering Design & Drawings', 'Dr. Ashane Fernando'),
+    ('NANO2172', 'Physical Chemistry for Nanotechnology', 'Dr. Murthi Kandanapitiye'),
+    ('NANO2182', 'Management for Technology', 'Ms. Malithi De Costa'),
+    ('ETCH2111', 'English Language & Communication Skills II', 'Ms. Sajeewani Fernando'),
+    ('PDEV2110', 'Career Development II', 'Dr. Mihira Wanninayake'),
+]
+ATTENDANCE_STATUSES = ['Present', 'Absent', 'Medical']  # stored as 1, 2, 3
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -29,33 +113,2549 @@ class User(db.Model):
     role = db.Column(db.String(20), nullable=False) # 'administrator', 'admin', or 'student'
     name = db.Column(db.String(100), nullable=False)
 
+    # Removing a user removes their attendance and medical reports (ON DELETE CASCADE)
+    attendance = db.relationship('Attendance', back_populates='student', cascade='all, delete', passive_deletes=True)
+    medical_reports = db.relationship('MedicalReport', back_populates='student', cascade='all, delete', passive_deletes=True)
+
+    __table_args__ = (
+        # User management table is listed (and paginated) by role, then index
+        db.Index('ix_user_role_index_number', 'role', 'index_number'),
+    )
+
+class Course(db.Model):
+    # Course catalog, read through course_catalog()
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(20), unique=True, nullable=False) # e.g. 'NANO2112'
+    name = db.Column(db.String(150), nullable=False)
+    lecturer = db.Column(db.String(100), nullable=True)
+
+class AttendanceStatus(db.TypeDecorator):
+    # Attendance status stored as a small integer and read back as its name ('Present', 'Absent', 'Medical')
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else ATTENDANCE_STATUSES.index(value) + 1
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else ATTENDANCE_STATUSES[value - 1]
+
 class Attendance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    student_index = db.Column(db.String(20), nullable=False)
-    course_code = db.Column(db.String(20), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     date = db.Column(db.Date, default=lambda: datetime.utcnow().date())
-    status = db.Column(db.String(10), nullable=False) # 'Present', 'Absent', 'Medical'
+    status = db.Column(AttendanceStatus, nullable=False) # 'Present', 'Absent', 'Medical'
+
+    student = db.relationship('User', back_populates='attendance')
+    course = db.relationship('Course')
+    medical_reports = db.relationship('MedicalReport', back_populates='attendance', cascade='all, delete', passive_deletes=True)
+
+    __table_args__ = (
+        # One record per student, course and day. Also serves every student_id lookup.
+        db.Index('uq_attendance_student_course_date', 'student_id', 'course_id', 'date', unique=True),
+        # Roster loads and course exports filter on course + date
+        db.Index('ix_attendance_course_date', 'course_id', 'date'),
+        # Dashboard and export listings are ordered by date
+        db.Index('ix_attendance_date', 'date'),
+    )
 
 class MedicalReport(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    student_index = db.Column(db.String(20), nullable=False)
-    attendance_id = db.Column(db.Integer, nullable=False) # Link to Attendance record
+    student_index = db.Column(db.String(20), db.ForeignKey('user.index_number', ondelete='CASCADE'), nullable=False, index=True)
+    attendance_id = db.Column(db.Integer, db.ForeignKey('attendance.id', ondelete='CASCADE'), nullable=True, index=True) # Link to Attendance record, NULL once the record is archived
     date_submitted = db.Column(db.DateTime, default=lambda: datetime.utcnow())
     document_path = db.Column(db.String(255), nullable=False) # Path to uploaded file
+    document_name = db.Column(db.String(255), nullable=True) # Original filename, for downloads
+    blob_id = db.Column(db.Integer, db.ForeignKey('document_blob.id'), nullable=True, index=True) # Stored file contents
     reason = db.Column(db.Text, nullable=True)
     approved = db.Column(db.Boolean, default=False)
     approved_by = db.Column(db.String(20), nullable=True) # Admin who approved
     approved_date = db.Column(db.DateTime, nullable=True)
 
+    student = db.relationship('User', back_populates='medical_reports')
+    attendance = db.relationship('Attendance', back_populates='medical_reports')
+    blob = db.relationship('DocumentBlob')
+
+    __table_args__ = (
+        # Pending reports list on the admin dashboard
+        db.Index('ix_medical_report_pending', 'approved', 'date_submitted'),
+    )
+
+class DocumentBlob(db.Model):
+    # An uploaded file stored once under its SHA-256, shared by every report that uploaded the same bytes
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0) # Medical reports using this blob
+    created_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
+
 class StudentCourse(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    student_index = db.Column(db.String(20), nullable=False)
-    course_code = db.Column(db.String(100), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+
+    __table_args__ = (
+        # Course rosters
+        db.Index('ix_student_course_course', 'course_id', 'student_id'),
+    )
+
+class ImportJob(db.Model):
+    # A CSV attendance import running in the background. Progress is committed together with
+    # each chunk of rows, so a failed job can resume right after its last committed chunk.
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False) # Original upload name
+    file_path = db.Column(db.String(255), nullable=False) # Saved copy the worker reads
+    status = db.Column(db.String(10), nullable=False, default='queued') # 'queued', 'running', 'completed', 'failed'
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    added = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=False, default='[]') # JSON list of the first row errors
+    failure = db.Column(db.Text, nullable=True) # Why the job failed
+    submitted_by = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
+    finished_at = db.Column(db.DateTime, nullable=True)
+    worker = db.Column(db.String(100), nullable=True) # Process that queued the job and runs it
+    heartbeat_at = db.Column(db.DateTime, nullable=True) # Last sign of life from that process
+
+class AttendanceRollup(db.Model):
+    # Present/Absent/Medical counts per student, course and month, kept in step with
+    # Attendance by every write path so dashboards never have to scan the history
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+    medical = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('uq_attendance_rollup_student_course_month', 'student_id', 'course_id', 'year', 'month', unique=True),
+        db.Index('ix_attendance_rollup_course_month', 'course_id', 'year', 'month'),
+    )
+
+class AttendanceVector(db.Model):
+    # A student's attendance in one course over one semester as bitmaps, a bit per day of the
+    # semester: attended (Present), excused (Medical) and absent. See Attendance Vectors.
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    semester = db.Column(db.String(10), nullable=False) # e.g. '2025-S1'
+    attended = db.Column(db.LargeBinary, nullable=False)
+    excused = db.Column(db.LargeBinary, nullable=False)
+    absent = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('uq_attendance_vector_student_course_semester', 'student_id', 'course_id', 'semester', unique=True),
+        # Whole-cohort reads for a course
+        db.Index('ix_attendance_vector_course_semester', 'course_id', 'semester', 'student_id'),
+    )
+
+class CourseCalendar(db.Model):
+    # The days a course held sessions (had any attendance recorded) in a semester, as a bitmap like AttendanceVector's
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    semester = db.Column(db.String(10), nullable=False)
+    sessions = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('uq_course_calendar_course_semester', 'course_id', 'semester', unique=True),
+    )
+
+class AttendanceArchive(db.Model):
+    # A closed semester whose attendance records were moved out of the live table into a
+    # read-only archive file (see Semester Archives). The file's footer carries the full statistics.
+    id = db.Column(db.Integer, primary_key=True)
+    semester = db.Column(db.String(10), unique=True, nullable=False) # e.g. '2025-S1'
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    min_date = db.Column(db.Date, nullable=True)
+    max_date = db.Column(db.Date, nullable=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
+
+class IngestEvent(db.Model):
+    # An event ID a scanner has already delivered, so a resent event isn't applied twice
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(50), nullable=False) # Scanner name from INGEST_TOKENS
+    event_id = db.Column(db.String(64), nullable=False) # Chosen by the scanner, unique per scanner
+    received_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.utcnow())
+
+    __table_args__ = (
+        db.Index('uq_ingest_event_source_event', 'source', 'event_id', unique=True),
+        # Pruning old event IDs
+        db.Index('ix_ingest_event_received_at', 'received_at'),
+    )
+
+# --- Course Catalog ---
+# Courses only change when the database is seeded or upgraded, so each process loads the
+# catalog once and serves forms, filters and course titles from memory.
+course_catalog_cache = {}
+
+def course_catalog():
+    # Every course as (id, code, name, lecturer, title) rows, in catalog order
+    if 'courses' not in course_catalog_cache:
+        courses = db.session.query(Course.id, Course.code, Course.name, Course.lecturer,
+                                   (Course.code + ' - ' + Course.name).label('title')).order_by(Course.id).all()
+        by_key = {}
+        for course in courses:
+            by_key[course.code] = by_key[course.title] = by_key[str(course.id)] = course
+        course_catalog_cache.update(by_id={course.id: course for course in courses}, by_key=by_key)
+        course_catalog_cache['courses'] = courses
+    return course_catalog_cache['courses']
+
+def reload_courses():
+    course_catalog_cache.clear()
+
+def find_course(value):
+    # The course with this id, code or full "CODE - Name" title, or None
+    course_catalog()
+    return course_catalog_cache['by_key'].get(str(value or '').strip())
+
+@app.template_filter('course_title')
+def course_title(course_id):
+    course_catalog()
+    course = course_catalog_cache['by_id'].get(course_id)
+    return course.title if course else f'Course {course_id}'
+
+def seed_courses():
+    # Fill an empty course table from the legacy subject table when there is one, otherwise from DEFAULT_COURSES
+    if Course.query.first() is not None:
+        return
+    courses = DEFAULT_COURSES
+    if db.inspect(db.engine).has_table('subject'):
+        courses = db.session.execute(db.text("SELECT code, name, lecturer FROM subject ORDER BY id")).all() or courses
+    db.session.execute(db.insert(Course), [{'code': code, 'name': name, 'lecturer': lecturer} for code, name, lecturer in courses])
+    db.session.commit()
+    reload_courses()
+
+ATTENDANCE_KEY = ['student_id', 'course_id', 'date']
+UPSERT_BATCH_SIZE = 2000  # rows per batch; a multi-row INSERT of this many rows stays under SQLite's 32766 bound parameter limit
+
+def upsert_insert(model):
+    # INSERT that supports ON CONFLICT clauses on the configured backend (SQLite or PostgreSQL)
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql_insert(model)
+    return sqlite_insert(model)
+
+ATTENDANCE_WRITE_LOCK = 0x756e6974  # PostgreSQL advisory lock keys: attendance writers
+BLOB_WRITE_LOCK = 0x756e6975  # ... and document blob references and files
+
+def begin_write(lock=ATTENDANCE_WRITE_LOCK, connection=None):
+    # Take a write lock for the rest of the transaction (of the session, or of connection), before
+    # reading the state a write depends on (e.g. the old status a rollup delta is computed from), so
+    # two writers can't both compute their change from the same old value. pysqlite only opens a
+    # transaction at the first INSERT/UPDATE, so on SQLite it starts as BEGIN IMMEDIATE instead;
+    # PostgreSQL takes a transaction-level advisory lock, which also covers records that don't exist yet.
+    connection = connection or db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(db.select(db.func.pg_advisory_xact_lock(lock)))
+
+def upsert_attendance(rows, overwrite=True):
+    # Insert attendance rows (dicts with student_id, course_id, date, status) in batches.
+    # Existing (student, course, date) records get their status overwritten, or are left
+    # untouched when overwrite=False. Rollups and vectors are updated alongside. The caller owns the transaction.
+    # Raises ValueError if a row falls in an archived semester.
+
+    # A statement may only touch each record once, so repeated keys keep the last (or first) row
+    unique_rows = {}
+    for row in rows:
+        key = (row['student_id'], row['course_id'], row['date'])
+        if overwrite or key not in unique_rows:
+            unique_rows[key] = row
+    rows = list(unique_rows.values())
+
+    if not rows:
+        return
+    # Under the lock, so a semester being archived meanwhile is seen as archived
+    begin_write()
+    ranges = archive_ranges()
+    for date_obj in {row['date'] for row in rows}:
+        semester = archived_semester(date_obj, ranges)
+        if semester:
+            raise ValueError(f"Semester {semester} is archived and read-only")
+
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        batch = rows[start:start + UPSERT_BATCH_SIZE]
+        previous = attendance_statuses(batch)
+
+        stmt = upsert_insert(Attendance).values(batch)
+        if overwrite:
+            stmt = stmt.on_conflict_do_update(index_elements=ATTENDANCE_KEY, set_={'status': stmt.excluded.status})
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=ATTENDANCE_KEY)
+        db.session.execute(stmt)
+
+        deltas = {}
+        vector_changes = []
+        changed = set()
+        for row in batch:
+            key = (row['student_id'], row['course_id'], row['date'])
+            old_status = previous.get(key)
+            if old_status is None:
+                add_rollup_delta(deltas, *key, row['status'], 1)
+            elif overwrite and old_status != row['status']:
+                add_rollup_delta(deltas, *key, old_status, -1)
+                add_rollup_delta(deltas, *key, row['status'], 1)
+            else:
+                continue
+            vector_changes.append((*key, old_status, row['status']))
+            changed.add(row['student_id'])
+        apply_rollup_deltas(deltas)
+        apply_vector_changes(vector_changes)
+        invalidate_students(changed)
+
+def attendance_statuses(rows):
+    # Current status of each (student_id, course_id, date) in rows that already has a record
+    keys = {(row['student_id'], row['course_id'], row['date']) for row in rows}
+    existing = db.session.query(Attendance.student_id, Attendance.course_id, Attendance.date, Attendance.status).filter(
+        Attendance.student_id.in_({key[0] for key in keys}),
+        Attendance.course_id.in_({key[1] for key in keys}),
+        Attendance.date.in_({key[2] for key in keys}),
+    )
+    return {(student_id, course_id, date_obj): status for student_id, course_id, date_obj, status in existing
+            if (student_id, course_id, date_obj) in keys}
+
+# --- Attendance Rollups ---
+ROLLUP_COUNTERS = {'Present': 'present', 'Absent': 'absent', 'Medical': 'medical'}
+
+def add_rollup_delta(deltas, student_id, course_id, date_obj, status, amount):
+    # Accumulate a +1/-1 change to a status counter, keyed by (student, course, year, month)
+    counter = ROLLUP_COUNTERS.get(status)
+    if counter:
+        counts = deltas.setdefault((student_id, course_id, date_obj.year, date_obj.month),
+                                   {'present': 0, 'absent': 0, 'medical': 0})
+        counts[counter] += amount
+
+def apply_rollup_deltas(deltas):
+    # Add accumulated counter changes to the rollup table in one upsert. The caller owns the transaction.
+    rows = [dict(zip(['student_id', 'course_id', 'year', 'month'], key), **counts)
+            for key, counts in deltas.items() if any(counts.values())]
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        stmt = upsert_insert(AttendanceRollup).values(rows[start:start + UPSERT_BATCH_SIZE])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['student_id', 'course_id', 'year', 'month'],
+            set_={counter: getattr(AttendanceRollup, counter) + getattr(stmt.excluded, counter)
+                  for counter in ROLLUP_COUNTERS.values()})
+        db.session.execute(stmt)
+
+def rollup_source_query():
+    # Rollup counters computed from the raw attendance history
+    year = db.extract('year', Attendance.date)
+    month = db.extract('month', Attendance.date)
+    return db.select(
+        Attendance.student_id, Attendance.course_id, year, month,
+        *[db.func.sum(db.case((Attendance.status == status, 1), else_=0)) for status in ROLLUP_COUNTERS],
+    ).group_by(Attendance.student_id, Attendance.course_id, year, month)
+
+def rebuild_rollups():
+    # Recompute every rollup row and attendance vector from scratch (live and archived records) in one transaction
+    db.session.execute(db.delete(AttendanceRollup))
+    db.session.execute(db.insert(AttendanceRollup).from_select(
+        ['student_id', 'course_id', 'year', 'month', 'present', 'absent', 'medical'], rollup_source_query()))
+    apply_rollup_deltas(archived_rollup_deltas())
+    rebuild_vectors()
+    db.session.commit()
+
+def check_rollups():
+    # Compare the rollup table with the attendance history, archived semesters included.
+    # Returns a list of (student, course, year, month, expected counts, stored counts) mismatches.
+    expected = {tuple(row[:4]): tuple(row[4:]) for row in db.session.execute(rollup_source_query())}
+    for key, counts in archived_rollup_deltas().items():
+        live = expected.get(key, (0, 0, 0))
+        expected[key] = tuple(count + counts[counter] for count, counter in zip(live, ROLLUP_COUNTERS.values()))
+    stored = {(r.student_id, r.course_id, r.year, r.month): (r.present, r.absent, r.medical)
+              for r in AttendanceRollup.query.all()}
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        # A zeroed rollup row is equivalent to no row at all
+        want = expected.get(key, (0, 0, 0))
+        have = stored.get(key, (0, 0, 0))
+        if want != have:
+            mismatches.append((*key, want, have))
+    return mismatches
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    rebuild_rollups()
+    print(f"Rebuilt {AttendanceRollup.query.count()} attendance rollups and {AttendanceVector.query.count()} attendance vectors.")
+
+@app.cli.command('check-rollups')
+def check_rollups_command():
+    mismatches = check_rollups()
+    for student_id, course_id, year, month, want, have in mismatches:
+        print(f"Student {student_id} {course_title(course_id)} {year}-{month:02d}: expected present/absent/medical {want}, found {have}")
+    print(f"{len(mismatches)} inconsistent rollups found." if mismatches else "Rollups are consistent.")
+    vector_mismatches = check_vectors()
+    for student_id, course_id, semester in vector_mismatches:
+        print(f"{f'Student {student_id}' if student_id else 'Calendar of'} {course_title(course_id)} {semester}: bitmaps differ from the history")
+    print(f"{len(vector_mismatches)} inconsistent attendance vectors found." if vector_mismatches else "Attendance vectors are consistent.")
+
+# --- Attendance Vectors ---
+# Each student's attendance in a course over a semester as bitmaps with one bit per day of the
+# semester (bit 0 = its first day, see semester_bounds), so rates, streaks and recent absences
+# are popcounts and masks over a few bytes. Every write path keeps them in step with Attendance,
+# like the rollups; archived semesters keep their vectors.
+VECTOR_BITMAPS = {'Present': 'attended', 'Medical': 'excused', 'Absent': 'absent'}
+
+def bitmap_int(data):
+    return int.from_bytes(data or b'', 'little')
+
+def int_bitmap(value):
+    return value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+def vector_bit(date_obj, semesters):
+    # (semester, bit) for a record's date; semesters memoizes semester_bounds by date
+    if date_obj not in semesters:
+        semester, start, _ = semester_bounds(date_obj)
+        semesters[date_obj] = (semester, 1 << (date_obj - start).days)
+    return semesters[date_obj]
+
+def apply_vector_changes(changes):
+    # Update attendance vectors and course calendars for (student_id, course_id, date, old status,
+    # new status) changes, old status None for a new record. The caller owns the transaction.
+    semesters = {}
+    updates = []
+    for student_id, course_id, date_obj, old_status, new_status in changes:
+        semester, bit = vector_bit(date_obj, semesters)
+        updates.append(((student_id, course_id, semester), bit, old_status, new_status))
+    if not updates:
+        return
+
+    # Read-modify-write, so the rows are locked on databases that support it
+    vectors = {}
+    keys = list({key for key, _, _, _ in updates})
+    for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+        rows = db.session.execute(db.select(
+            AttendanceVector.student_id, AttendanceVector.course_id, AttendanceVector.semester,
+            AttendanceVector.attended, AttendanceVector.excused, AttendanceVector.absent,
+        ).where(db.tuple_(AttendanceVector.student_id, AttendanceVector.course_id, AttendanceVector.semester)
+                .in_(keys[start:start + UPSERT_BATCH_SIZE])).with_for_update())
+        for student_id, course_id, semester, *bitmaps in rows:
+            vectors[(student_id, course_id, semester)] = dict(zip(VECTOR_BITMAPS.values(), map(bitmap_int, bitmaps)))
+    calendar_keys = list({(key[1], key[2]) for key, _, _, _ in updates})
+    calendars = {(course_id, semester): bitmap_int(sessions) for course_id, semester, sessions in db.session.execute(
+        db.select(CourseCalendar.course_id, CourseCalendar.semester, CourseCalendar.sessions)
+        .where(db.tuple_(CourseCalendar.course_id, CourseCalendar.semester).in_(calendar_keys)).with_for_update())}
+
+    for key, bit, old_status, new_status in updates:
+        vector = vectors.setdefault(key, dict.fromkeys(VECTOR_BITMAPS.values(), 0))
+        if old_status:
+            vector[VECTOR_BITMAPS[old_status]] &= ~bit
+        vector[VECTOR_BITMAPS[new_status]] |= bit
+        calendars[(key[1], key[2])] = calendars.get((key[1], key[2]), 0) | bit
+    save_vectors(vectors, calendars)
+
+def save_vectors(vectors, calendars):
+    # Upsert {(student_id, course_id, semester): {bitmap: int}} vectors and {(course_id, semester): int} calendars
+    stmt = upsert_insert(AttendanceVector)
+    stmt = stmt.on_conflict_do_update(index_elements=['student_id', 'course_id', 'semester'],
+                                      set_={name: getattr(stmt.excluded, name) for name in VECTOR_BITMAPS.values()})
+    rows = [{'student_id': student_id, 'course_id': course_id, 'semester': semester,
+             **{name: int_bitmap(value) for name, value in bitmaps.items()}}
+            for (student_id, course_id, semester), bitmaps in vectors.items()]
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        db.session.execute(stmt, rows[start:start + UPSERT_BATCH_SIZE])
+    stmt = upsert_insert(CourseCalendar)
+    stmt = stmt.on_conflict_do_update(index_elements=['course_id', 'semester'], set_={'sessions': stmt.excluded.sessions})
+    rows = [{'course_id': course_id, 'semester': semester, 'sessions': int_bitmap(sessions)}
+            for (course_id, semester), sessions in calendars.items()]
+    if rows:
+        db.session.execute(stmt, rows)
+
+def vector_source():
+    # Vectors and calendars computed from every live and archived record of a current student
+    semesters = {}
+    vectors = {}
+    calendars = {}
+    students = {student_id for (student_id,) in db.session.query(User.id)}
+    live = db.session.execute(db.select(Attendance.id, Attendance.student_id, Attendance.course_id, Attendance.date, Attendance.status)
+                              .execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for _, student_id, course_id, date_obj, status in itertools.chain(live, archived_records(matching_archives({}))):
+        if student_id not in students or status not in VECTOR_BITMAPS:
+            continue
+        semester, bit = vector_bit(date_obj, semesters)
+        vector = vectors.setdefault((student_id, course_id, semester), dict.fromkeys(VECTOR_BITMAPS.values(), 0))
+        vector[VECTOR_BITMAPS[status]] |= bit
+        calendars[(course_id, semester)] = calendars.get((course_id, semester), 0) | bit
+    return vectors, calendars
+
+def rebuild_vectors():
+    # Recompute every attendance vector and course calendar. The caller owns the transaction.
+    db.session.execute(db.delete(AttendanceVector))
+    db.session.execute(db.delete(CourseCalendar))
+    save_vectors(*vector_source())
+
+def check_vectors():
+    # Compare the stored vectors and calendars with the attendance history.
+    # Returns a list of the (student_id or None, course_id, semester) keys that differ.
+    vectors, calendars = vector_source()
+    stored = {(row.student_id, row.course_id, row.semester): {name: bitmap_int(getattr(row, name)) for name in VECTOR_BITMAPS.values()}
+              for row in AttendanceVector.query.all()}
+    stored_calendars = {(row.course_id, row.semester): bitmap_int(row.sessions) for row in CourseCalendar.query.all()}
+    empty = dict.fromkeys(VECTOR_BITMAPS.values(), 0)
+    mismatches = [key for key in sorted(set(vectors) | set(stored)) if vectors.get(key, empty) != stored.get(key, empty)]
+    mismatches.extend((None, *key) for key in sorted(set(calendars) | set(stored_calendars))
+                      if calendars.get(key, 0) != stored_calendars.get(key, 0))
+    return mismatches
+
+def session_stats(attended, excused, absent, session_bits, last):
+    # Counts, rate, current streak and absences in the last `last` sessions for one vector.
+    # session_bits are the course calendar's bits, newest first. The streak counts the most
+    # recent sessions attended or excused in a row; sessions without a record are passed over.
+    present, medical, missed = attended.bit_count(), excused.bit_count(), absent.bit_count()
+    total = present + medical + missed
+    kept = attended | excused
+    streak = 0
+    for bit in session_bits:
+        if kept & bit:
+            streak += 1
+        elif absent & bit:
+            break
+    recent = sum(session_bits[:last])
+    return {
+        'present': present,
+        'absent': missed,
+        'medical': medical,
+        'total': total,
+        'rate': round((present + medical) * 100 / total, 2) if total else None,
+        'streak': streak,
+        'missed_recently': (absent & recent).bit_count(),
+    }
+
+def semester_session_rates(params):
+    # One keyset page of per-student session statistics for a semester, computed from the vectors
+    # of a whole cohort at once. Returns (rows, next_cursor); the cursor is "<course_id>:<student_id>".
+    stmt = db.select(AttendanceVector.course_id, AttendanceVector.student_id, AttendanceVector.attended, AttendanceVector.excused,
+                     AttendanceVector.absent, User.index_number, User.name, CourseCalendar.sessions) \
+        .join(User, User.id == AttendanceVector.student_id) \
+        .join(CourseCalendar, db.and_(CourseCalendar.course_id == AttendanceVector.course_id,
+                                      CourseCalendar.semester == AttendanceVector.semester)) \
+        .where(AttendanceVector.semester == params['semester'])
+    if 'course' in params:
+        stmt = stmt.where(AttendanceVector.course_id == params['course'])
+    if 'student_index' in params:
+        stmt = stmt.where(User.index_number == params['student_index'])
+    if 'after' in params:
+        stmt = stmt.where(db.tuple_(AttendanceVector.course_id, AttendanceVector.student_id) > keyset_cursor(params, 2))
+    rows = db.session.execute(stmt.order_by(AttendanceVector.course_id, AttendanceVector.student_id)
+                              .limit(params['limit'] + 1)).all()
+
+    last = params.get('last', ANALYTICS_RECENT_SESSIONS)
+    session_bits = {}  # course_id -> calendar bits, newest first
+    results = []
+    for course_id, _, attended, excused, absent, index_number, name, sessions in rows[:params['limit']]:
+        if course_id not in session_bits:
+            calendar = bitmap_int(sessions)
+            session_bits[course_id] = [1 << day for day in range(calendar.bit_length() - 1, -1, -1) if calendar >> day & 1]
+        stats = session_stats(bitmap_int(attended), bitmap_int(excused), bitmap_int(absent), session_bits[course_id], last)
+        results.append({
+            'student_index': index_number,
+            'name': name,
+            'course_id': course_id,
+            'course': course_title(course_id),
+            'sessions': len(session_bits[course_id]),
+            **stats,
+            'below_threshold': stats['rate'] is not None and stats['rate'] < params['threshold'],
+        })
+    next_cursor = f"{rows[params['limit'] - 1].course_id}:{rows[params['limit'] - 1].student_id}" if len(rows) > params['limit'] else None
+    return results, next_cursor
+
+# --- CSV Import ---
+CSV_COLUMNS = ['student_index', 'date', 'status']
+IMPORT_CHUNK_SIZE = 1000  # rows validated, inserted and committed together
+
+def import_attendance_csv(reader, course_id, start_row=2, on_chunk=None):
+    # Import attendance rows for one course from a csv.DictReader over the upload.
+    # Rows are validated and written a chunk at a time: one query for the students,
+    # one for existing records and a bulk insert per chunk, each chunk committed on its own.
+    # Rows before start_row are skipped (they were committed by an earlier run). on_chunk(added,
+    # skipped, errors, last_row) is called with each chunk's results just before it commits.
+    # Returns {'added': n, 'skipped': n, 'errors': ['Row n: reason', ...]}.
+    result = {'added': 0, 'skipped': 0, 'errors': []}
+    seen = set()  # (student, date) keys already imported from this file
+    chunk = []
+    for row_num, row in enumerate(reader, start=2):
+        if row_num < start_row:
+            continue
+        chunk.append((row_num, row))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            _import_attendance_chunk(chunk, course_id, seen, result, on_chunk)
+            chunk = []
+    if chunk:
+        _import_attendance_chunk(chunk, course_id, seen, result, on_chunk)
+    return result
+
+def _import_attendance_chunk(chunk, course_id, seen, result, on_chunk=None):
+    errors = []  # (row_num, message), reported in row order once the chunk is done
+    parsed = []
+    for row_num, row in chunk:
+        try:
+            parsed.append((row_num, row['student_index'].strip(), row['date'].strip(), row['status'].strip()))
+        except Exception as e:
+            errors.append((row_num, f"Row {row_num}: {str(e)}"))
+
+    # Validate student exists
+    indices = {student_idx for _, student_idx, _, _ in parsed}
+    students = dict(db.session.query(User.index_number, User.id).filter(
+        User.index_number.in_(indices), User.role == 'student').all())
+
+    ranges = archive_ranges()
+    valid = []
+    for row_num, student_idx, date_str, status in parsed:
+        if student_idx not in students:
+            errors.append((row_num, f"Row {row_num}: Student {student_idx} not found"))
+            continue
+
+        # Validate status
+        if status not in ['Present', 'Absent']:
+            errors.append((row_num, f"Row {row_num}: Invalid status '{status}' (must be 'Present' or 'Absent')"))
+            continue
+
+        # Validate date format
+        try:
+            date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            errors.append((row_num, f"Row {row_num}: Invalid date format '{date_str}' (use YYYY-MM-DD)"))
+            continue
+        semester = archived_semester(date_obj, ranges)
+        if semester:
+            errors.append((row_num, f"Row {row_num}: Semester {semester} is archived and read-only"))
+            continue
+        valid.append((students[student_idx], date_obj, status))
+
+    # Check which records already exist, in the database or earlier in this file
+    existing = set(db.session.query(Attendance.student_id, Attendance.date).filter(
+        Attendance.course_id == course_id,
+        Attendance.student_id.in_({student_id for student_id, _, _ in valid}),
+        Attendance.date.in_({date_obj for _, date_obj, _ in valid}),
+    ).all())
+    rows = []
+    for student_id, date_obj, status in valid:
+        key = (student_id, date_obj)
+        if key in existing or key in seen:
+            continue
+        seen.add(key)
+        rows.append({'student_id': student_id, 'course_id': course_id, 'status': status, 'date': date_obj})
+
+    upsert_attendance(rows, overwrite=False)
+    skipped = len(chunk) - len(rows)
+    messages = [message for _, message in sorted(errors)]
+    if on_chunk:
+        on_chunk(len(rows), skipped, messages, chunk[-1][0])
+    db.session.commit()
+    result['added'] += len(rows)
+    result['skipped'] += skipped
+    result['errors'].extend(messages)
+
+def flash_row_errors(errors):
+    # Show per-row import errors, at most 10 of them
+    if errors and len(errors) <= 10:
+        for error in errors:
+            flash(error, 'warning')
+    elif errors:
+        flash(f'First 10 errors shown. {len(errors) - 10} more errors found.', 'warning')
+        for error in errors[:10]:
+            flash(error, 'warning')
+
+# --- Background Imports ---
+# Jobs run on a thread pool in the process that queued them. That process stamps a heartbeat on
+# its queued and running jobs; any process can mark jobs whose heartbeat has gone stale as failed
+# (their process died), so they can be resumed. Saved uploads are removed once a job completes,
+# or once a failed job has not been resumed within IMPORT_RESUME_HOURS.
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+IMPORT_HEARTBEAT_SECONDS = int(os.environ.get('IMPORT_HEARTBEAT_SECONDS', 30))
+IMPORT_STALE_AFTER = IMPORT_HEARTBEAT_SECONDS * 4  # seconds without a heartbeat before a job counts as abandoned
+IMPORT_RESUME_HOURS = int(os.environ.get('IMPORT_RESUME_HOURS', 24))  # failed jobs keep their upload this long
+MAX_JOB_ERRORS = 100  # row errors kept on a job for display
+import_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix='import')
+import_process = {}  # pid, worker id and heartbeat thread of this process (reset after a fork)
+import_process_lock = threading.Lock()
+
+def import_worker_id():
+    # Identifies this process on the jobs it runs. The random part keeps a restarted
+    # process that reuses a pid (e.g. pid 1 in a container) from adopting old jobs.
+    with import_process_lock:
+        if import_process.get('pid') != os.getpid():
+            import_process.clear()
+            import_process.update(pid=os.getpid(), id=f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}')
+        return import_process['id']
+
+@app.before_request
+def start_import_heartbeat():
+    # Once per process: recover abandoned jobs and start stamping this process's jobs as alive
+    worker_id = import_worker_id()
+    with import_process_lock:
+        if import_process.get('heartbeat'):
+            return
+        import_process['heartbeat'] = threading.Thread(target=import_heartbeat, args=(worker_id,),
+                                                       name='import-heartbeat', daemon=True)
+        import_process['heartbeat'].start()
+
+def import_heartbeat(worker_id):
+    while True:
+        with app.app_context():
+            try:
+                db.session.execute(db.update(ImportJob)
+                                   .where(ImportJob.worker == worker_id, ImportJob.status.in_(['queued', 'running']))
+                                   .values(heartbeat_at=datetime.utcnow()))
+                db.session.commit()
+                recover_import_jobs()
+                remove_stale_uploads()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Import job heartbeat failed')
+        time.sleep(IMPORT_HEARTBEAT_SECONDS)
+
+def queue_import_job(job):
+    # Queue a new or failed job on this process's workers. Commits.
+    job.status = 'queued'
+    job.worker = import_worker_id()
+    job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    import_executor.submit(run_import_job, job.id)
+
+def run_import_job(job_id):
+    # Worker entry point: import (or resume importing) a saved CSV file, committing progress
+    # with every chunk. Runs in its own thread, so it needs its own app context and session.
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if job is None or job.status != 'queued':
+            return
+        job.status = 'running'
+        job.failure = None
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+        def record_progress(added, skipped, errors, last_row):
+            job.added += added
+            job.skipped += skipped
+            job.error_count += len(errors)
+            stored = json.loads(job.errors)
+            if len(stored) < MAX_JOB_ERRORS:
+                job.errors = json.dumps(stored + errors[:MAX_JOB_ERRORS - len(stored)])
+            job.rows_processed = last_row - 1
+            job.heartbeat_at = datetime.utcnow()
+
+        try:
+            with open(job.file_path, encoding='utf8', newline='') as f:
+                reader = csv.DictReader(f)
+                import_attendance_csv(reader, job.course_id, start_row=job.rows_processed + 2, on_chunk=record_progress)
+            job.status = 'completed'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            os.remove(job.file_path)
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(ImportJob, job_id)
+            job.status = 'failed'
+            job.failure = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+def recover_import_jobs():
+    # Jobs left queued or running by a process that stopped (no heartbeat for IMPORT_STALE_AFTER
+    # seconds) are marked failed so they can be resumed. Jobs of live processes are left alone.
+    stale = datetime.utcnow() - timedelta(seconds=IMPORT_STALE_AFTER)
+    db.session.execute(db.update(ImportJob)
+                       .where(ImportJob.status.in_(['queued', 'running']),
+                              db.or_(ImportJob.heartbeat_at.is_(None), ImportJob.heartbeat_at < stale))
+                       .values(status='failed', failure='Interrupted by a server restart.', finished_at=datetime.utcnow()))
+    db.session.commit()
+
+def remove_stale_uploads():
+    # Delete the saved uploads of failed jobs nobody resumed within IMPORT_RESUME_HOURS, and
+    # files no job refers to (an upload whose job was never created) once they are as old
+    cutoff = datetime.utcnow() - timedelta(hours=IMPORT_RESUME_HOURS)
+    expired = ImportJob.query.filter(ImportJob.status == 'failed', ImportJob.finished_at < cutoff,
+                                     ImportJob.file_path != '').all()
+    for job in expired:
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        job.file_path = ''
+    db.session.commit()
+
+    in_use = {os.path.abspath(path) for (path,) in db.session.query(ImportJob.file_path).filter(ImportJob.file_path != '')}
+    for entry in os.scandir(app.config['IMPORT_FOLDER']):
+        if entry.is_file() and os.path.abspath(entry.path) not in in_use and \
+                datetime.utcfromtimestamp(entry.stat().st_mtime) < cutoff:
+            os.remove(entry.path)
+
+# --- User Import ---
+USER_CSV_COLUMNS = ['index_number', 'name', 'role', 'password', 'courses']
+USER_ROLES = ['student', 'admin', 'administrator']
+USER_IMPORT_CHUNK_SIZE = 500  # users hashed, inserted and committed together
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', os.cpu_count() or 1))
+
+def import_users_csv(reader):
+    # Create users (and their StudentCourse enrollments) from a csv.DictReader over the upload.
+    # courses holds course codes or full course names separated by ';' and is ignored for staff.
+    # Passwords are hashed on a process pool; each chunk is checked with one query and inserted in one transaction.
+    # Returns {'added': n, 'skipped': n, 'errors': ['Row n: reason', ...]}.
+    result = {'added': 0, 'skipped': 0, 'errors': []}
+    seen = set()  # index numbers already imported from this file
+    with ProcessPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        chunk = []
+        for row_num, row in enumerate(reader, start=2):
+            chunk.append((row_num, row))
+            if len(chunk) >= USER_IMPORT_CHUNK_SIZE:
+                _import_users_chunk(chunk, executor, seen, result)
+                chunk = []
+        if chunk:
+            _import_users_chunk(chunk, executor, seen, result)
+    return result
+
+def _import_users_chunk(chunk, executor, seen, result):
+    errors = []  # (row_num, message), reported in row order once the chunk is done
+    parsed = []
+    for row_num, row in chunk:
+        try:
+            index = row['index_number'].strip()
+            name = row['name'].strip()
+            role = row['role'].strip()
+            password = row['password']
+            courses = [c.strip() for c in (row['courses'] or '').split(';') if c.strip()]
+        except Exception as e:
+            errors.append((row_num, f"Row {row_num}: {str(e)}"))
+            continue
+        if not index or not name or not password:
+            errors.append((row_num, f"Row {row_num}: index_number, name and password are required"))
+            continue
+        if role not in USER_ROLES:
+            errors.append((row_num, f"Row {row_num}: Invalid role '{role}' (must be one of {', '.join(USER_ROLES)})"))
+            continue
+        unknown = [c for c in courses if find_course(c) is None]
+        if unknown:
+            errors.append((row_num, f"Row {row_num}: Unknown course '{unknown[0]}'"))
+            continue
+        parsed.append((row_num, index, name, role, password, [find_course(c).id for c in courses]))
+
+    # Validate user doesn't exist yet, in the database or earlier in this file
+    existing = {index for (index,) in db.session.query(User.index_number).filter(
+        User.index_number.in_({index for _, index, _, _, _, _ in parsed}))}
+    new_users = []
+    for row_num, index, name, role, password, courses in parsed:
+        if index in existing or index in seen:
+            errors.append((row_num, f"Row {row_num}: User {index} already exists"))
+            continue
+        seen.add(index)
+        new_users.append((index, name, role, password, courses))
+
+    if new_users:
+        hashes = executor.map(generate_password_hash, [password for _, _, _, password, _ in new_users], chunksize=16)
+        db.session.execute(db.insert(User), [
+            {'index_number': index, 'name': name, 'role': role, 'password': password_hash}
+            for (index, name, role, _, _), password_hash in zip(new_users, hashes)
+        ])
+    enrolling = {index: courses for index, _, role, _, courses in new_users if courses and role == 'student'}
+    if enrolling:
+        user_ids = dict(db.session.query(User.index_number, User.id).filter(User.index_number.in_(enrolling)).all())
+        db.session.execute(db.insert(StudentCourse), [
+            {'student_id': user_ids[index], 'course_id': course_id}
+            for index, courses in enrolling.items() for course_id in dict.fromkeys(courses)
+        ])
+    db.session.commit()
+    result['added'] += len(new_users)
+    result['skipped'] += len(errors)
+    result['errors'].extend(message for _, message in sorted(errors))
+
+# --- Attendance Export ---
+EXPORT_BATCH_SIZE = 1000  # rows fetched from the cursor and written per chunk
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def parse_attendance_filters(args):
+    # The course, student, status and date range filters in a request's args, as a dict with
+    # course_id, student_index, status, date_from and date_to for the filters that were given.
+    # Raises ValueError on a malformed date or an unknown course or status.
+    filters = {}
+    if args.get('course'):
+        course = find_course(args['course'])
+        if course is None:
+            raise ValueError(f"Unknown course {args['course']}")
+        filters['course_id'] = course.id
+    if args.get('student_index'):
+        filters['student_index'] = args['student_index'].strip()
+    if args.get('status'):
+        if args['status'] not in ATTENDANCE_STATUSES:
+            raise ValueError(f"Unknown status {args['status']}")
+        filters['status'] = args['status']
+    if args.get('date_from'):
+        filters['date_from'] = datetime.strptime(args['date_from'], '%Y-%m-%d').date()
+    if args.get('date_to'):
+        filters['date_to'] = datetime.strptime(args['date_to'], '%Y-%m-%d').date()
+    return filters
+
+def attendance_conditions(filters):
+    # SQL conditions on the live attendance table for parsed filters (a student_id may be given too)
+    conditions = []
+    if 'course_id' in filters:
+        conditions.append(Attendance.course_id == filters['course_id'])
+    if 'student_id' in filters:
+        conditions.append(Attendance.student_id == filters['student_id'])
+    if 'student_index' in filters:
+        conditions.append(Attendance.student_id == db.select(User.id).where(
+            User.index_number == filters['student_index']).scalar_subquery())
+    if 'status' in filters:
+        conditions.append(Attendance.status == filters['status'])
+    if 'date_from' in filters:
+        conditions.append(Attendance.date >= filters['date_from'])
+    if 'date_to' in filters:
+        conditions.append(Attendance.date <= filters['date_to'])
+    return conditions
+
+def attendance_filters(args):
+    # SQL conditions for the filters in a request's args. Raises ValueError like parse_attendance_filters.
+    return attendance_conditions(parse_attendance_filters(args))
+
+def stream_attendance(filters, fmt='csv'):
+    # Yield the attendance records matching parsed filters as CSV or NDJSON text, one chunk
+    # per EXPORT_BATCH_SIZE rows. Live records are read from a server-side cursor and merged
+    # with any archived semesters the filters can match, newest first, so memory stays flat.
+    stmt = db.select(Attendance.id, Attendance.date, User.index_number, Attendance.course_id, Attendance.status) \
+        .join(User, Attendance.student_id == User.id) \
+        .where(*attendance_conditions(filters)) \
+        .order_by(Attendance.date.desc(), Attendance.id.desc()) \
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    rows = db.session.execute(stmt)
+    archives = matching_archives(filters)
+    if archives:
+        rows = heapq.merge(rows, archived_export_rows(archives),
+                           key=lambda row: (row[1], row[0]), reverse=True)
+    batches = iter(lambda: list(itertools.islice(rows, EXPORT_BATCH_SIZE)), [])
+
+    if fmt == 'ndjson':
+        for batch in batches:
+            yield ''.join(json.dumps({'student_index': student_idx, 'date': date_obj.isoformat(),
+                                      'course_code': course_title(course_id), 'status': status}) + '\n'
+                          for _, date_obj, student_idx, course_id, status in batch)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Student Index', 'Date', 'Course', 'Status'])
+    for batch in batches:
+        writer.writerows((student_idx, date_obj, course_title(course_id), status) for _, date_obj, student_idx, course_id, status in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def gzip_stream(chunks):
+    # Compress a stream of text chunks into a gzip file on the fly
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+# --- Semester Archives ---
+# Closed semesters are moved out of the live attendance table into one read-only file each, so
+# the table and its indexes only hold the current term. A file stores its records newest first
+# in row groups of ARCHIVE_GROUP_ROWS; within a group every column is its own zlib-compressed
+# little-endian array, with ids and dates delta-encoded. A JSON footer at the end of the file
+# holds the semester's date range, per-course and per-status counts and each group's date,
+# student and course ranges, so readers skip the files and groups a query can't match and only
+# decode the remaining columns of groups that have matches.
+# Rollups keep counting archived records, so statistics and analytics don't change on archival.
+SEMESTER_START_MONTHS = sorted(int(month) for month in os.environ.get('SEMESTER_START_MONTHS', '1,7').split(','))
+ARCHIVE_MAGIC = b'UTARCH1\n'
+ARCHIVE_GROUP_ROWS = 65536
+# (column, array typecode, delta-encoded), in record order
+ARCHIVE_COLUMNS = [('id', 'q', True), ('student_id', 'i', False), ('course_id', 'i', False),
+                   ('date', 'i', True), ('status', 'b', False)]
+ARCHIVE_COLUMN_TYPES = {name: (typecode, delta) for name, typecode, delta in ARCHIVE_COLUMNS}
+STATUS_CODES = {status: code for code, status in enumerate(ATTENDANCE_STATUSES, start=1)}
+archive_footers = {}  # path -> parsed footer; archive files never change once written
+
+def semester_bounds(date_obj):
+    # (name, first day, last day) of the semester containing date_obj
+    months = [month for month in SEMESTER_START_MONTHS if month <= date_obj.month]
+    if months:
+        year, number = date_obj.year, len(months)
+    else:  # before the first start month: still in last year's final semester
+        year, number = date_obj.year - 1, len(SEMESTER_START_MONTHS)
+    start = date(year, SEMESTER_START_MONTHS[number - 1], 1)
+    if number < len(SEMESTER_START_MONTHS):
+        end = date(year, SEMESTER_START_MONTHS[number], 1) - timedelta(days=1)
+    else:
+        end = date(year + 1, SEMESTER_START_MONTHS[0], 1) - timedelta(days=1)
+    return f'{year}-S{number}', start, end
+
+def semester_start(name):
+    # First day of a semester from its name, e.g. '2025-S1'. Raises ValueError for a malformed name.
+    year, separator, number = name.partition('-S')
+    if not separator or not year.isdigit() or not number.isdigit() or not 1 <= int(number) <= len(SEMESTER_START_MONTHS):
+        raise ValueError(f'Unknown semester {name}')
+    return date(int(year), SEMESTER_START_MONTHS[int(number) - 1], 1)
+
+def write_archive(path, records, semester, start, end):
+    # Write (id, student_id, course_id, date ordinal, status code) records, newest first, to a
+    # new archive file and return its footer. The file only appears at path once it is complete.
+    footer = {'semester': semester, 'start_date': start.isoformat(), 'end_date': end.isoformat(),
+              'rows': 0, 'min_date': None, 'max_date': None, 'min_student': None, 'max_student': None,
+              'courses': Counter(), 'statuses': Counter(), 'groups': []}
+    records = iter(records)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(ARCHIVE_MAGIC)
+        for group in iter(lambda: list(itertools.islice(records, ARCHIVE_GROUP_ROWS)), []):
+            columns = list(zip(*group))
+            entry = {'rows': len(group), 'min_day': min(columns[3]), 'max_day': max(columns[3]),
+                     'min_student': min(columns[1]), 'max_student': max(columns[1]),
+                     'courses': sorted(set(columns[2])), 'columns': {}}
+            for (name, typecode, delta), values in zip(ARCHIVE_COLUMNS, columns):
+                if delta:
+                    values = [values[0]] + [b - a for a, b in zip(values, values[1:])]
+                data = array(typecode, values)
+                if sys.byteorder == 'big':
+                    data.byteswap()
+                chunk = zlib.compress(data.tobytes(), 6)
+                entry['columns'][name] = [f.tell(), len(chunk)]
+                f.write(chunk)
+            footer['groups'].append(entry)
+            footer['rows'] += len(group)
+            footer['courses'].update(columns[2])
+            footer['statuses'].update(columns[4])
+        groups = footer['groups']
+        if groups:
+            footer['min_date'] = date.fromordinal(min(group['min_day'] for group in groups)).isoformat()
+            footer['max_date'] = date.fromordinal(max(group['max_day'] for group in groups)).isoformat()
+            footer['min_student'] = min(group['min_student'] for group in groups)
+            footer['max_student'] = max(group['max_student'] for group in groups)
+        footer['courses'] = {str(course_id): count for course_id, count in sorted(footer['courses'].items())}
+        footer['statuses'] = {ATTENDANCE_STATUSES[code - 1]: count for code, count in sorted(footer['statuses'].items())}
+        data = json.dumps(footer, separators=(',', ':')).encode('utf-8')
+        f.write(data)
+        f.write(struct.pack('<Q', len(data)) + ARCHIVE_MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+    return footer
+
+def archive_footer(path):
+    # The parsed footer of an archive file
+    footer = archive_footers.get(path)
+    if footer is None:
+        with open(path, 'rb') as f:
+            f.seek(-16, os.SEEK_END)
+            length, magic = struct.unpack('<Q8s', f.read(16))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f'{path} is not an attendance archive')
+            f.seek(-16 - length, os.SEEK_END)
+            footer = archive_footers[path] = json.loads(f.read(length))
+    return footer
+
+def read_archive_column(f, group, name):
+    # Decode one column of a row group
+    typecode, delta = ARCHIVE_COLUMN_TYPES[name]
+    offset, length = group['columns'][name]
+    f.seek(offset)
+    values = array(typecode)
+    values.frombytes(zlib.decompress(f.read(length)))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return list(itertools.accumulate(values)) if delta else values
+
+def scan_archive(path, student_id=None, course_id=None, status=None, first_day=None, last_day=None):
+    # Yield the (id, student_id, course_id, date ordinal, status code) records of an archive file
+    # that match the filters, newest first. Groups whose ranges rule the filters out are skipped,
+    # and the filtered columns are decoded before the rest so groups without matches stop early.
+    footer = archive_footer(path)
+    filters = [(name, value) for name, value in [('student_id', student_id), ('course_id', course_id), ('status', status)]
+               if value is not None]
+    with open(path, 'rb') as f:
+        for group in footer['groups']:
+            if (student_id is not None and not group['min_student'] <= student_id <= group['max_student']) \
+                    or (course_id is not None and course_id not in group['courses']) \
+                    or (first_day is not None and group['max_day'] < first_day) \
+                    or (last_day is not None and group['min_day'] > last_day):
+                continue
+            columns = {}
+            selected = range(group['rows'])
+            for name, value in filters:
+                column = columns[name] = read_archive_column(f, group, name)
+                selected = [i for i in selected if column[i] == value]
+            if selected and (first_day is not None or last_day is not None):
+                low, high = first_day or 0, last_day or date.max.toordinal()
+                days = columns['date'] = read_archive_column(f, group, 'date')
+                selected = [i for i in selected if low <= days[i] <= high]
+            if not selected:
+                continue
+            ids, students, courses, days, statuses = (
+                columns[name] if name in columns else read_archive_column(f, group, name) for name, _, _ in ARCHIVE_COLUMNS)
+            for i in selected:
+                yield ids[i], students[i], courses[i], days[i], statuses[i]
+
+def matching_archives(filters):
+    # Archives whose statistics don't rule out attendance filters (as from parse_attendance_filters,
+    # or with a student_id), newest first, as (path, scan_archive arguments) pairs
+    query = db.session.query(AttendanceArchive.path).filter(AttendanceArchive.rows > 0)
+    if 'date_from' in filters:
+        query = query.filter(AttendanceArchive.max_date >= filters['date_from'])
+    if 'date_to' in filters:
+        query = query.filter(AttendanceArchive.min_date <= filters['date_to'])
+    paths = [path for (path,) in query.order_by(AttendanceArchive.start_date.desc())]
+    if not paths:
+        return []
+
+    student_id = filters.get('student_id')
+    if 'student_index' in filters:
+        student_id = db.session.query(User.id).filter_by(index_number=filters['student_index']).scalar()
+        if student_id is None:
+            return []
+    scan = {'student_id': student_id, 'course_id': filters.get('course_id'),
+            'status': STATUS_CODES.get(filters.get('status')),
+            'first_day': filters['date_from'].toordinal() if 'date_from' in filters else None,
+            'last_day': filters['date_to'].toordinal() if 'date_to' in filters else None}
+    archives = []
+    for path in paths:
+        footer = archive_footer(path)
+        if (student_id is not None and not footer['min_student'] <= student_id <= footer['max_student']) \
+                or ('course_id' in filters and str(filters['course_id']) not in footer['courses']) \
+                or ('status' in filters and filters['status'] not in footer['statuses']):
+            continue
+        archives.append((path, scan))
+    return archives
+
+def archived_records(archives):
+    # Records of matching archives (see matching_archives), newest first,
+    # as (id, student_id, course_id, date, status) tuples
+    for path, scan in archives:
+        for id, student_id, course_id, day, status in scan_archive(path, **scan):
+            yield id, student_id, course_id, date.fromordinal(day), ATTENDANCE_STATUSES[status - 1]
+
+def archived_export_rows(archives):
+    # Archived records as export rows: (id, date, student index, course_id, status). Records of
+    # students removed since their semester was archived are left out, as they are from the live table.
+    indices = dict(db.session.query(User.id, User.index_number).all())
+    for id, student_id, course_id, date_obj, status in archived_records(archives):
+        if student_id in indices:
+            yield id, date_obj, indices[student_id], course_id, status
+
+def archived_rollup_deltas():
+    # Rollup counters of every archived record of a current student
+    students = {student_id for (student_id,) in db.session.query(User.id)}
+    deltas = {}
+    for _, student_id, course_id, date_obj, status in archived_records(matching_archives({})):
+        if student_id in students:
+            add_rollup_delta(deltas, student_id, course_id, date_obj, status, 1)
+    return deltas
+
+def archive_ranges():
+    # (semester, first day, last day) of every archived semester
+    return db.session.query(AttendanceArchive.semester, AttendanceArchive.start_date, AttendanceArchive.end_date).all()
+
+def archived_semester(date_obj, ranges):
+    # Name of the archived semester (from archive_ranges) containing date_obj, or None when it's live
+    for semester, start, end in ranges:
+        if start <= date_obj <= end:
+            return semester
+    return None
+
+def pending_report_records():
+    # Attendance ids with a medical report still waiting for review (no NULLs, which would make NOT IN match nothing)
+    return db.select(MedicalReport.attendance_id).where(MedicalReport.approved == False, MedicalReport.attendance_id.isnot(None))
+
+def archive_semester(date_obj):
+    # Move the live records of the semester containing date_obj into its archive file, merged with
+    # the semester's earlier archive if there is one. Records with a pending medical report stay live
+    # so the report can still be reviewed; an approved report's outcome is archived as the record's
+    # Medical status and the report itself is kept, unlinked from the record. Returns the number of records moved.
+    semester, start, end = semester_bounds(date_obj)
+    moved = array('q')
+
+    def live_records():
+        stmt = db.select(Attendance.id, Attendance.student_id, Attendance.course_id, Attendance.date, Attendance.status) \
+            .where(Attendance.date.between(start, end), Attendance.id.not_in(pending_report_records())) \
+            .order_by(Attendance.date.desc(), Attendance.id.desc()) \
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        for id, student_id, course_id, day, status in db.session.execute(stmt):
+            moved.append(id)
+            yield id, student_id, course_id, day.toordinal(), STATUS_CODES[status]
+
+    # Attendance writers (marking, imports, ingestion, medical approvals) wait until the records are
+    # both in the archive file and deleted, so a change made in between can't be lost
+    begin_write()
+    archive = AttendanceArchive.query.filter_by(semester=semester).first()
+    old_path = archive.path if archive else None
+    records = live_records()
+    if old_path:
+        records = heapq.merge(records, scan_archive(old_path), key=lambda record: (record[3], record[0]), reverse=True)
+    path = os.path.join(app.config['ARCHIVE_FOLDER'], f'attendance-{semester}-{uuid.uuid4().hex[:8]}.uta')
+    try:
+        footer = write_archive(path, records, semester, start, end)
+        if not moved:
+            db.session.rollback()
+            os.remove(path)
+            return 0
+        for chunk_start in range(0, len(moved), UPSERT_BATCH_SIZE):
+            chunk = moved[chunk_start:chunk_start + UPSERT_BATCH_SIZE].tolist()
+            # Deleting the record would otherwise take its reviewed reports with it
+            db.session.execute(db.update(MedicalReport).where(MedicalReport.attendance_id.in_(chunk))
+                               .values(attendance_id=None).execution_options(synchronize_session=False))
+            db.session.execute(db.delete(Attendance).where(Attendance.id.in_(chunk))
+                               .execution_options(synchronize_session=False))
+        if archive is None:
+            archive = AttendanceArchive(semester=semester, start_date=start, end_date=end)
+            db.session.add(archive)
+        archive.path = path
+        archive.rows = footer['rows']
+        archive.min_date = date.fromisoformat(footer['min_date'])
+        archive.max_date = date.fromisoformat(footer['max_date'])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    if old_path:
+        os.remove(old_path)
+        archive_footers.pop(old_path, None)
+    return len(moved)
+
+def archive_closed_semesters(today=None):
+    # Archive every semester that ended before the current one began.
+    # Returns {semester: records moved} for the semesters that still had live records.
+    _, current_start, _ = semester_bounds(today or datetime.utcnow().date())
+    results = {}
+    archived_until = None
+    while True:
+        query = db.session.query(db.func.min(Attendance.date)).filter(
+            Attendance.date < current_start, Attendance.id.not_in(pending_report_records()))
+        if archived_until:
+            query = query.filter(Attendance.date > archived_until)
+        oldest = query.scalar()
+        if oldest is None:
+            return results
+        semester, _, archived_until = semester_bounds(oldest)
+        results[semester] = archive_semester(oldest)
+
+@app.cli.command('archive-semesters')
+@click.option('--today', type=click.DateTime(formats=['%Y-%m-%d']), help='Archive as of this day instead of today.')
+@click.option('--vacuum', is_flag=True, help='Give the freed space back to the filesystem (SQLite).')
+def archive_semesters_command(today, vacuum):
+    results = archive_closed_semesters(today.date() if today else None)
+    for semester, moved in results.items():
+        print(f"Archived {moved} attendance records of {semester}.")
+    if not results:
+        print("No closed semesters left to archive.")
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+        print("Vacuumed the database.")
+
+# --- Document Storage ---
+# Medical documents are stored content-addressed under UPLOAD_FOLDER/ab/cd/<sha256>, so a
+# certificate uploaded for several absences takes disk space once. Blobs are reference counted
+# from MedicalReport and deleted when the last report using them goes away.
+BLOB_CHUNK_SIZE = 64 * 1024
+
+def blob_path(sha256):
+    return os.path.join(app.config['UPLOAD_FOLDER'], sha256[:2], sha256[2:4], sha256)
+
+BLOB_ORPHAN_AGE = 3600  # seconds before gc-blobs removes a file no blob row claims
+
+def store_blob(stream):
+    # Stream a file to disk while hashing it, keep one copy per distinct content and take a
+    # reference on its blob. Returns the DocumentBlob. The caller owns the transaction; if it
+    # rolls back, a file this call put in place is removed again (see discard_new_blob_files).
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(BLOB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+
+        # The reference is taken before the file goes into place, under the blob lock held until
+        # the caller commits, so collect_blobs can't delete this blob's row or file in between
+        begin_write(BLOB_WRITE_LOCK)
+        db.session.execute(upsert_insert(DocumentBlob).values(sha256=sha256, size=size, ref_count=0)
+                           .on_conflict_do_nothing(index_elements=['sha256']))
+        db.session.execute(db.update(DocumentBlob).where(DocumentBlob.sha256 == sha256)
+                           .values(ref_count=DocumentBlob.ref_count + 1))
+        path = blob_path(sha256)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            db.session.info.setdefault('new_blob_files', set()).add(sha256)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return DocumentBlob.query.filter_by(sha256=sha256).one()
+
+@event.listens_for(Session, 'after_commit')
+def forget_new_blob_files(session):
+    session.info.pop('new_blob_files', None)
+
+@event.listens_for(Session, 'after_transaction_end')
+def discard_new_blob_files(session, transaction):
+    # Files placed by a transaction that ended without committing (rolled back or closed) belong
+    # to no blob, unless another transaction committed a reference to the same content meanwhile
+    if transaction.parent is not None:
+        return
+    sha256s = session.info.pop('new_blob_files', None)
+    if sha256s:
+        with db.engine.connect() as conn:
+            begin_write(BLOB_WRITE_LOCK, conn)
+            remove_unclaimed_blob_files(conn, sha256s)
+            conn.commit()
+
+def remove_unclaimed_blob_files(conn, sha256s):
+    # Delete the files of the given hashes that no blob row refers to. Call under the blob lock.
+    claimed = set(conn.execute(db.select(DocumentBlob.sha256).where(DocumentBlob.sha256.in_(list(sha256s)))).scalars())
+    removed = 0
+    for sha256 in set(sha256s) - claimed:
+        if os.path.exists(blob_path(sha256)):
+            os.remove(blob_path(sha256))
+            removed += 1
+    return removed
+
+def release_blobs(counts):
+    # Drop references ({blob_id: n}) on blobs. Call collect_blobs() with the same ids after committing.
+    for blob_id, count in counts.items():
+        db.session.execute(db.update(DocumentBlob).where(DocumentBlob.id == blob_id)
+                           .values(ref_count=DocumentBlob.ref_count - count))
+
+def collect_blobs(blob_ids=None):
+    # Delete blobs (rows and files) that no report references any more. Checks the given ids, or every blob.
+    query = db.session.query(DocumentBlob.id, DocumentBlob.sha256).filter(DocumentBlob.ref_count <= 0)
+    if blob_ids is not None:
+        query = query.filter(DocumentBlob.id.in_(blob_ids))
+    removed = 0
+    for blob_id, sha256 in query.all():
+        # Re-check the count in the DELETE itself in case a new upload just took a reference. The
+        # file goes while the blob lock is held, so an upload of the same content waiting for the
+        # lock finds it missing and puts its own copy in place.
+        begin_write(BLOB_WRITE_LOCK)
+        deleted = db.session.execute(db.delete(DocumentBlob).where(DocumentBlob.id == blob_id, DocumentBlob.ref_count <= 0)).rowcount
+        if deleted and os.path.exists(blob_path(sha256)):
+            os.remove(blob_path(sha256))
+            removed += 1
+        db.session.commit()
+    return removed
+
+def collect_orphan_files():
+    # Delete stored files without a blob row (left by a crash between placing a file and committing
+    # its reference) and abandoned partial uploads, once they are BLOB_ORPHAN_AGE seconds old
+    cutoff = time.time() - BLOB_ORPHAN_AGE
+    candidates = {}
+    for root, _, files in os.walk(app.config['UPLOAD_FOLDER']):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if name.startswith('.upload-'):
+                os.remove(path)
+            elif len(name) == 64 and path == blob_path(name):
+                candidates[name] = path
+    with db.engine.connect() as conn:
+        begin_write(BLOB_WRITE_LOCK, conn)
+        removed = remove_unclaimed_blob_files(conn, candidates)
+        conn.commit()
+    return removed
+
+def recount_blobs():
+    # Recompute every blob's reference count from the medical reports that point at it
+    references = db.select(db.func.count(MedicalReport.id)).where(MedicalReport.blob_id == DocumentBlob.id).scalar_subquery()
+    db.session.execute(db.update(DocumentBlob).values(ref_count=references))
+    db.session.commit()
+
+def migrate_medical_documents():
+    # Move documents saved before content-addressed storage into the blob store
+    moved = 0
+    for report in MedicalReport.query.filter(MedicalReport.blob_id.is_(None)).all():
+        if not os.path.isfile(report.document_path):
+            continue
+        old_path = report.document_path
+        with open(old_path, 'rb') as f:
+            blob = store_blob(f)
+        report.blob_id = blob.id
+        report.document_path = blob_path(blob.sha256)
+        report.document_name = report.document_name or os.path.basename(old_path)
+        db.session.commit()
+        os.remove(old_path)
+        moved += 1
+    return moved
+
+@app.cli.command('gc-blobs')
+def gc_blobs_command():
+    # Recount references and delete unreferenced medical document blobs
+    recount_blobs()
+    print(f"Removed {collect_blobs()} unreferenced documents and {collect_orphan_files()} untracked files.")
+
+# --- Medical Report Review ---
+# Approving or rejecting any number of reports is a few set-based statements in one transaction:
+# per chunk of ids, one read of the reports and their attendance, then an UPDATE (or DELETE)
+# per table, instead of loading and committing every report on its own.
+REVIEW_BATCH_SIZE = 500  # report ids per statement
+
+def review_medical_reports(report_ids, action, reviewer):
+    # Approve or reject ('approve' / 'reject') medical reports and commit.
+    # Returns {report_id: outcome}: 'approved', 'rejected', 'not_found', 'already_approved'
+    # (approving a report twice changes nothing) or 'no_attendance'.
+    report_ids = list(dict.fromkeys(report_ids))
+    results = dict.fromkeys(report_ids, 'not_found')
+    released = Counter()
+    for start in range(0, len(report_ids), REVIEW_BATCH_SIZE):
+        chunk = report_ids[start:start + REVIEW_BATCH_SIZE]
+        if action == 'approve':
+            _approve_medical_reports(chunk, reviewer, results)
+        else:
+            released.update(_reject_medical_reports(chunk, results))
+    db.session.commit()
+    if released:
+        collect_blobs(list(released))
+    return results
+
+def _approve_medical_reports(report_ids, reviewer, results):
+    begin_write()
+    rows = db.session.execute(db.select(
+        MedicalReport.id, MedicalReport.approved, Attendance.id.label('attendance_id'),
+        Attendance.student_id, Attendance.course_id, Attendance.date, Attendance.status,
+    ).outerjoin(Attendance, Attendance.id == MedicalReport.attendance_id).where(MedicalReport.id.in_(report_ids))).all()
+    pending = {}
+    for row in rows:
+        if row.approved:
+            results[row.id] = 'already_approved'
+        elif row.attendance_id is None:
+            results[row.id] = 'no_attendance'
+        else:
+            pending[row.id] = row
+    if not pending:
+        return
+
+    # Only reports this statement actually flips count, in case another admin got there first
+    approved = db.session.execute(db.update(MedicalReport)
+                                  .where(MedicalReport.id.in_(list(pending)), MedicalReport.approved == False)
+                                  .values(approved=True, approved_by=reviewer, approved_date=datetime.utcnow())
+                                  .returning(MedicalReport.id)
+                                  .execution_options(synchronize_session=False)).scalars().all()
+    deltas = {}
+    vector_changes = []
+    flipped = {}
+    for report_id in approved:
+        row = pending[report_id]
+        results[report_id] = 'approved'
+        if row.status != 'Medical' and row.attendance_id not in flipped:
+            flipped[row.attendance_id] = row
+            add_rollup_delta(deltas, row.student_id, row.course_id, row.date, row.status, -1)
+            add_rollup_delta(deltas, row.student_id, row.course_id, row.date, 'Medical', 1)
+            vector_changes.append((row.student_id, row.course_id, row.date, row.status, 'Medical'))
+    for report_id in set(pending) - set(approved):
+        results[report_id] = 'already_approved'
+    if flipped:
+        db.session.execute(db.update(Attendance).where(Attendance.id.in_(list(flipped))).values(status='Medical')
+                           .execution_options(synchronize_session=False))
+        apply_rollup_deltas(deltas)
+        apply_vector_changes(vector_changes)
+        invalidate_students({row.student_id for row in flipped.values()})
+
+def _reject_medical_reports(report_ids, results):
+    # Deleting a report drops its reference on the stored document. Returns the released
+    # {blob_id: references}; documents nobody uses any more are removed after the commit.
+    deleted = db.session.execute(db.delete(MedicalReport).where(MedicalReport.id.in_(report_ids))
+                                 .returning(MedicalReport.id, MedicalReport.blob_id, MedicalReport.student_index)
+                                 .execution_options(synchronize_session=False)).all()
+    if not deleted:
+        return {}
+    blob_counts = Counter(blob_id for _, blob_id, _ in deleted if blob_id)
+    release_blobs(blob_counts)
+    invalidate_students(db.session.execute(db.select(User.id).where(
+        User.index_number.in_({student_index for _, _, student_index in deleted}))).scalars().all())
+    for report_id, _, _ in deleted:
+        results[report_id] = 'rejected'
+    return blob_counts
+
+# --- Attendance Statistics ---
+def monthly_attendance_stats(student_id):
+    # Present/absent/medical/total counts and attendance percentage per month for one student,
+    # newest month first, keyed by month name (e.g. 'December 2025'). Read from the rollups.
+    counts = db.session.query(
+        AttendanceRollup.year, AttendanceRollup.month,
+        db.func.sum(AttendanceRollup.present), db.func.sum(AttendanceRollup.absent), db.func.sum(AttendanceRollup.medical),
+    ).filter(AttendanceRollup.student_id == student_id) \
+        .group_by(AttendanceRollup.year, AttendanceRollup.month) \
+        .order_by(AttendanceRollup.year.desc(), AttendanceRollup.month.desc()) \
+        .all()
+    
+    monthly_stats = {}
+    for year, month, present_count, absent_count, medical_count in counts:
+        total = present_count + absent_count + medical_count
+        if total == 0:
+            continue
+        percentage = present_count / total * 100
+        
+        month_name = datetime(year, month, 1).strftime('%B %Y')
+        monthly_stats[month_name] = {
+            'present': present_count,
+            'absent': absent_count,
+            'medical': medical_count,
+            'total': total,
+            'percentage': round(percentage, 2)
+        }
+    return monthly_stats
+
+# --- Dashboard Cache ---
+# Student dashboard data is cached under a per-student version number. Every write that
+# touches a student's attendance bumps that version once its transaction commits, so stale
+# entries are never read again and simply age out of the LRU / TTL.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local')  # 'local' (per process) or 'redis' (shared)
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 300))  # seconds
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+
+class LocalCache:
+    # In-process LRU cache with a TTL per entry. Versions live outside the LRU so they are never evicted.
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def version(self, name):
+        with self.lock:
+            return self.versions.get(name, 0)
+
+    def bump(self, name):
+        with self.lock:
+            self.versions[name] = self.versions.get(name, 0) + 1
+
+    def size(self):
+        return len(self.entries)
+
+class RedisCache:
+    # Cache shared by every worker process. Redis evicts entries by TTL (and its own maxmemory policy).
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(f'unitrack:{key}')
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.setex(f'unitrack:{key}', self.ttl, pickle.dumps(value))
+
+    def version(self, name):
+        return int(self.client.get(f'unitrack:version:{name}') or 0)
+
+    def bump(self, name):
+        self.client.incr(f'unitrack:version:{name}')
+
+    def size(self):
+        return None
+
+dashboard_cache = RedisCache(CACHE_REDIS_URL, CACHE_TTL) if CACHE_BACKEND == 'redis' else LocalCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+cache_stats = {'hits': 0, 'misses': 0}
+
+def invalidate_students(student_ids):
+    # Bump the dashboard version of these students when the current transaction commits
+    db.session.info.setdefault('changed_students', set()).update(student_ids)
+
+@event.listens_for(Session, 'after_commit')
+def bump_changed_students(session):
+    changed = session.info.pop('changed_students', ())
+    for student_id in changed:
+        dashboard_cache.bump(f'student:{student_id}')
+    if changed:
+        # Analytics reports cover every student, so any change retires all of them
+        dashboard_cache.bump('attendance')
+
+@event.listens_for(Session, 'after_rollback')
+def forget_changed_students(session):
+    session.info.pop('changed_students', None)
+
+def student_dashboard_data(student_id):
+    # Attendance records and monthly stats for a student's dashboard, served from the cache when current
+    key = f"student_dashboard:{student_id}:{dashboard_cache.version(f'student:{student_id}')}"
+    data = dashboard_cache.get(key)
+    if data is not None:
+        cache_stats['hits'] += 1
+        return data
+    
+    cache_stats['misses'] += 1
+    records = db.session.query(Attendance.id, Attendance.date, Attendance.course_id, Attendance.status) \
+        .filter(Attendance.student_id == student_id) \
+        .order_by(Attendance.date.desc()) \
+        .all()
+    records = [{'id': id, 'date': date_obj, 'course': course_title(course_id), 'status': status}
+               for id, date_obj, course_id, status in records]
+    archives = matching_archives({'student_id': student_id})
+    if archives:
+        records.extend({'id': id, 'date': date_obj, 'course': course_title(course_id), 'status': status}
+                       for id, _, course_id, date_obj, status in archived_records(archives))
+        records.sort(key=lambda record: record['date'], reverse=True)
+    # The stats are a second, separate query on purpose: they read the rollup counters, which stay
+    # small however long the history gets, instead of re-aggregating the records listed above
+    data = {
+        'records': records,
+        'monthly_stats': monthly_attendance_stats(student_id),
+    }
+    dashboard_cache.set(key, data)
+    return data
+
+# --- Request Metrics ---
+# Each request counts its SQL queries, SQL time and template render time (engine events and
+# Flask signals). Per-route aggregates are served in Prometheus format at /metrics, and queries
+# slower than SLOW_QUERY_MS are logged with the route and their parameters.
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')  # file path; slow queries go to stderr when unset
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # lets Prometheus scrape /metrics with "Authorization: Bearer <token>"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+slow_query_log = logging.getLogger('unitrack.slow_queries')
+slow_query_log.setLevel(logging.WARNING)
+if SLOW_QUERY_LOG:
+    slow_query_handler = logging.FileHandler(SLOW_QUERY_LOG)
+    slow_query_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_query_log.addHandler(slow_query_handler)
+    slow_query_log.propagate = False
+
+class Histogram:
+    # Cumulative bucket counts, as Prometheus expects them
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class RequestMetrics:
+    # Aggregates for this process since it started. Every worker process keeps its own.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = {}  # (method, route, status) -> count
+        self.routes = {}  # (method, route) -> latency/query histograms and SQL/render totals
+        self.slow_queries = 0
+
+    def record(self, method, route, status, duration, queries, sql_time, render_time):
+        with self.lock:
+            key = (method, route, str(status))
+            self.responses[key] = self.responses.get(key, 0) + 1
+            stats = self.routes.get((method, route))
+            if stats is None:
+                stats = self.routes[(method, route)] = {
+                    'latency': Histogram(LATENCY_BUCKETS),
+                    'queries': Histogram(QUERY_COUNT_BUCKETS),
+                    'sql_seconds': 0.0,
+                    'render_seconds': 0.0,
+                }
+            stats['latency'].observe(duration)
+            stats['queries'].observe(queries)
+            stats['sql_seconds'] += sql_time
+            stats['render_seconds'] += render_time
+
+    def record_slow_query(self):
+        with self.lock:
+            self.slow_queries += 1
+
+request_metrics = RequestMetrics()
+
+def prometheus_labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def prometheus_histogram(lines, name, labels, histogram):
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        lines.append(f'{name}_bucket{prometheus_labels(**labels, le=bound)} {count}')
+    lines.append(f'{name}_bucket{prometheus_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f'{name}_sum{prometheus_labels(**labels)} {histogram.sum}')
+    lines.append(f'{name}_count{prometheus_labels(**labels)} {histogram.count}')
+
+def prometheus_metrics():
+    # Request and cache metrics in the Prometheus text exposition format
+    lines = []
+    with request_metrics.lock:
+        lines += ['# HELP unitrack_http_responses_total Responses served, by route and status.',
+                  '# TYPE unitrack_http_responses_total counter']
+        for (method, route, status), count in sorted(request_metrics.responses.items()):
+            lines.append(f'unitrack_http_responses_total{prometheus_labels(method=method, route=route, status=status)} {count}')
+
+        routes = sorted(request_metrics.routes.items())
+        lines += ['# HELP unitrack_http_request_duration_seconds Request latency, including streamed bodies.',
+                  '# TYPE unitrack_http_request_duration_seconds histogram']
+        for (method, route), stats in routes:
+            prometheus_histogram(lines, 'unitrack_http_request_duration_seconds', {'method': method, 'route': route}, stats['latency'])
+        lines += ['# HELP unitrack_http_request_queries SQL queries issued per request.',
+                  '# TYPE unitrack_http_request_queries histogram']
+        for (method, route), stats in routes:
+            prometheus_histogram(lines, 'unitrack_http_request_queries', {'method': method, 'route': route}, stats['queries'])
+        for name, key, help_text in [('unitrack_sql_seconds_total', 'sql_seconds', 'Time spent executing SQL.'),
+                                     ('unitrack_render_seconds_total', 'render_seconds', 'Time spent rendering templates.')]:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (method, route), stats in routes:
+                lines.append(f'{name}{prometheus_labels(method=method, route=route)} {stats[key]}')
+
+        lines += ['# HELP unitrack_slow_queries_total Queries slower than the slow-query threshold.',
+                  '# TYPE unitrack_slow_queries_total counter',
+                  f'unitrack_slow_queries_total {request_metrics.slow_queries}']
+
+    lines += ['# HELP unitrack_dashboard_cache_requests_total Student dashboard cache lookups.',
+              '# TYPE unitrack_dashboard_cache_requests_total counter',
+              f'unitrack_dashboard_cache_requests_total{prometheus_labels(result="hit")} {cache_stats["hits"]}',
+              f'unitrack_dashboard_cache_requests_total{prometheus_labels(result="miss")} {cache_stats["misses"]}']
+    entries = dashboard_cache.size()
+    if entries is not None:
+        lines += ['# HELP unitrack_dashboard_cache_entries Dashboards held in the in-process cache.',
+                  '# TYPE unitrack_dashboard_cache_entries gauge',
+                  f'unitrack_dashboard_cache_entries {entries}']
+    return '\n'.join(lines) + '\n'
+
+def current_route():
+    # Route template (e.g. /admin/import-jobs/<int:job_id>) of the running request, or the worker thread's name
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return threading.current_thread().name
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info.pop('query_started', time.perf_counter())
+    metrics = g.get('request_metrics') if has_app_context() else None
+    if metrics is not None:
+        metrics['queries'] += 1
+        metrics['sql_time'] += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        request_metrics.record_slow_query()
+        params = repr(parameters)
+        if len(params) > 1000:
+            params = params[:1000] + '...'
+        slow_query_log.warning('Slow query (%.1f ms) during %s: %s; parameters: %s',
+                               elapsed * 1000, current_route(), ' '.join(statement.split()), params)
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    metrics = g.get('request_metrics')
+    started = g.pop('render_started', None)
+    if metrics is not None and started is not None:
+        metrics['render_time'] += time.perf_counter() - started
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = {'started': time.perf_counter(), 'queries': 0, 'sql_time': 0.0, 'render_time': 0.0}
+
+@app.after_request
+def add_debug_header(response):
+    # Streamed responses (exports) only report what happened before the body started
+    metrics = g.get('request_metrics')
+    if metrics is not None:
+        metrics['status'] = response.status_code
+        # Administrators can ask for the request's own breakdown with "X-Debug-Metrics: 1"
+        if request.headers.get('X-Debug-Metrics') == '1' and session.get('role') == 'administrator':
+            total = time.perf_counter() - metrics['started']
+            response.headers['X-Query-Count'] = str(metrics['queries'])
+            response.headers['Server-Timing'] = (f'sql;dur={metrics["sql_time"] * 1000:.1f};desc="{metrics["queries"]} queries", '
+                                                 f'render;dur={metrics["render_time"] * 1000:.1f}, total;dur={total * 1000:.1f}')
+    return response
+
+@app.teardown_request
+def record_request_metrics(exception):
+    # Runs once the response (including a streamed body) is finished
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return
+    status = 500 if exception is not None else metrics.get('status', 500)
+    request_metrics.record(request.method, current_route(), status, time.perf_counter() - metrics['started'],
+                           metrics['queries'], metrics['sql_time'], metrics['render_time'])
+
+# --- Dashboard Pagination ---
+RECORDS_PAGE_SIZE = 50
+USERS_PAGE_SIZE = 50
+# Query string arguments that page or search the dashboard rather than filter attendance records
+PAGINATION_ARGS = ['records_before', 'users_after', 'users_q']
+
+def attendance_page(conditions, cursor=None):
+    # One page of attendance records, newest first, using keyset pagination on (date, id).
+    # cursor is the "<date>.<id>" of the last record on the previous page. Records are
+    # (id, date, student_index, course_id, status) rows.
+    # Returns (records, next_cursor); next_cursor is None on the last page.
+    query = db.session.query(Attendance.id, Attendance.date, User.index_number.label('student_index'),
+                             Attendance.course_id, Attendance.status) \
+        .join(User, Attendance.student_id == User.id) \
+        .filter(*conditions)
+    if cursor:
+        date_str, _, record_id = cursor.partition('.')
+        query = query.filter(db.tuple_(Attendance.date, Attendance.id) <
+                             (datetime.strptime(date_str, '%Y-%m-%d').date(), int(record_id)))
+    records = query.order_by(Attendance.date.desc(), Attendance.id.desc()).limit(RECORDS_PAGE_SIZE + 1).all()
+    if len(records) <= RECORDS_PAGE_SIZE:
+        return records, None
+    records = records[:RECORDS_PAGE_SIZE]
+    return records, f'{records[-1].date.isoformat()}.{records[-1].id}'
+
+def users_page(cursor=None):
+    # One page of users ordered by role then index number. cursor is "<role>:<index_number>"
+    # of the last user on the previous page. Returns (users, next_cursor).
+    query = User.query
+    if cursor:
+        role, _, index = cursor.partition(':')
+        query = query.filter(db.tuple_(User.role, User.index_number) > (role, index))
+    users = query.order_by(User.role, User.index_number).limit(USERS_PAGE_SIZE + 1).all()
+    if len(users) <= USERS_PAGE_SIZE:
+        return users, None
+    users = users[:USERS_PAGE_SIZE]
+    return users, f'{users[-1].role}:{users[-1].index_number}'
+
+# --- Search ---
+# Typeahead search over users (index number, name) and courses (code, name). On SQLite they are
+# indexed in an FTS5 table with the trigram tokenizer, so a term matches anywhere in an index
+# number or name. Triggers on the user and course tables keep it in sync on every write path
+# (forms, bulk imports, profile edits, removals). Other databases search the tables with LIKE.
+# Matches are ranked exact index number/code first, then prefixes, then by relevance.
+SEARCH_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+SEARCH_MAX_TERMS = 5
+# rowid = id * 2 for users and id * 2 + 1 for courses, so triggers find a row without a scan
+SEARCH_SCHEMA = [
+    "CREATE VIRTUAL TABLE search_index USING fts5(kind UNINDEXED, ref UNINDEXED, label, name, role UNINDEXED, tokenize='trigram')",
+    "CREATE TRIGGER search_user_insert AFTER INSERT ON \"user\" BEGIN "
+    "INSERT INTO search_index (rowid, kind, ref, label, name, role) VALUES (new.id * 2, 'user', new.id, new.index_number, new.name, new.role); END",
+    "CREATE TRIGGER search_user_update AFTER UPDATE OF index_number, name, role ON \"user\" BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 2; "
+    "INSERT INTO search_index (rowid, kind, ref, label, name, role) VALUES (new.id * 2, 'user', new.id, new.index_number, new.name, new.role); END",
+    "CREATE TRIGGER search_user_delete AFTER DELETE ON \"user\" BEGIN DELETE FROM search_index WHERE rowid = old.id * 2; END",
+    "CREATE TRIGGER search_course_insert AFTER INSERT ON course BEGIN "
+    "INSERT INTO search_index (rowid, kind, ref, label, name) VALUES (new.id * 2 + 1, 'course', new.id, new.code, new.name); END",
+    "CREATE TRIGGER search_course_update AFTER UPDATE OF code, name ON course BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 2 + 1; "
+    "INSERT INTO search_index (rowid, kind, ref, label, name) VALUES (new.id * 2 + 1, 'course', new.id, new.code, new.name); END",
+    "CREATE TRIGGER search_course_delete AFTER DELETE ON course BEGIN DELETE FROM search_index WHERE rowid = old.id * 2 + 1; END",
+]
+search_index = db.table('search_index', db.column('rowid'), db.column('kind'), db.column('ref'),
+                        db.column('label'), db.column('name'), db.column('role'))
+search_index_cache = {}  # database URL -> whether the FTS index exists
+
+def create_search_index():
+    # Create and fill the FTS index and its triggers (SQLite only). Returns False when
+    # this SQLite build has no FTS5, in which case searches fall back to LIKE.
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    search_index_cache.clear()
+    if db.inspect(db.engine).has_table('search_index'):
+        return True
+    try:
+        for statement in SEARCH_SCHEMA:
+            db.session.execute(db.text(statement))
+    except OperationalError:
+        db.session.rollback()
+        return False
+    fill_search_index()
+    db.session.commit()
+    return True
+
+def fill_search_index():
+    # Reindex every user and course. The caller owns the transaction.
+    db.session.execute(db.delete(search_index))
+    db.session.execute(db.insert(search_index).from_select(
+        ['rowid', 'kind', 'ref', 'label', 'name', 'role'],
+        db.select(User.id * 2, db.literal('user'), User.id, User.index_number, User.name, User.role)))
+    db.session.execute(db.insert(search_index).from_select(
+        ['rowid', 'kind', 'ref', 'label', 'name'],
+        db.select(Course.id * 2 + 1, db.literal('course'), Course.id, Course.code, Course.name)))
+
+def has_search_index():
+    url = str(db.engine.url)
+    if url not in search_index_cache:
+        search_index_cache[url] = db.engine.dialect.name == 'sqlite' and db.inspect(db.engine).has_table('search_index')
+    return search_index_cache[url]
+
+def like_pattern(term):
+    # Escape LIKE wildcards in a search term (use with escape='\\')
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search(query, kind=None, role=None, limit=SEARCH_LIMIT):
+    # Users and courses matching every term of query, best first, as dicts:
+    # {'kind': 'user', 'id', 'index_number', 'name', 'role'} or {'kind': 'course', 'id', 'code', 'name'}.
+    # kind ('user' or 'course') and role narrow the results.
+    terms = query.split()[:SEARCH_MAX_TERMS]
+    if not terms:
+        return []
+    if not has_search_index():
+        return fallback_search(terms, kind, role, limit)
+
+    # Terms of 3+ characters go through the trigram index; shorter ones can only be word prefixes
+    conditions = []
+    long_terms = [term for term in terms if len(term) >= 3]
+    if long_terms:
+        conditions.append(db.text('search_index MATCH :match').bindparams(
+            match=' AND '.join('"' + term.replace('"', '""') + '"' for term in long_terms)))
+    for term in terms:
+        if len(term) < 3:
+            pattern = like_pattern(term)
+            conditions.append(db.or_(search_index.c.label.like(f'{pattern}%', escape='\\'),
+                                     search_index.c.name.like(f'{pattern}%', escape='\\'),
+                                     search_index.c.name.like(f'% {pattern}%', escape='\\')))
+    if kind:
+        conditions.append(search_index.c.kind == kind)
+    if role:
+        conditions.append(search_index.c.role == role)
+    first = like_pattern(terms[0])
+    rank = db.case((search_index.c.label == query.strip(), 0),
+                   (search_index.c.label.like(f'{first}%', escape='\\'), 1),
+                   (search_index.c.name.like(f'{first}%', escape='\\'), 2),
+                   else_=3)
+    order = [rank, db.text('bm25(search_index, 0, 0, 10.0, 1.0, 0)')] if long_terms else [rank]
+    rows = db.session.execute(db.select(search_index.c.kind, search_index.c.ref, search_index.c.label,
+                                        search_index.c.name, search_index.c.role)
+                              .where(*conditions).order_by(*order, search_index.c.label).limit(limit)).all()
+    return [search_result(*row) for row in rows]
+
+def fallback_search(terms, kind, role, limit):
+    # search() without the FTS index: LIKE over users, and the in-memory course catalog
+    results = []
+    if kind in (None, 'user'):
+        patterns = [f'%{like_pattern(term)}%' for term in terms]
+        first = like_pattern(terms[0])
+        rank = db.case((db.func.lower(User.index_number) == ' '.join(terms).lower(), 0),
+                       (User.index_number.ilike(f'{first}%', escape='\\'), 1),
+                       (User.name.ilike(f'{first}%', escape='\\'), 2),
+                       else_=3)
+        query = db.session.query(User.id, User.index_number, User.name, User.role).filter(
+            *[db.or_(User.index_number.ilike(pattern, escape='\\'), User.name.ilike(pattern, escape='\\')) for pattern in patterns])
+        if role:
+            query = query.filter(User.role == role)
+        results += [(rank_value, search_result('user', *row)) for *row, rank_value in
+                    query.add_columns(rank).order_by(rank, User.index_number).limit(limit)]
+    if kind in (None, 'course') and not role:
+        for course in course_catalog():
+            text = f'{course.code} {course.name}'.lower()
+            if all(term.lower() in text for term in terms):
+                code = course.code.lower()
+                first = terms[0].lower()
+                rank_value = 0 if code == ' '.join(terms).lower() else 1 if code.startswith(first) else \
+                    2 if course.name.lower().startswith(first) else 3
+                results.append((rank_value, search_result('course', course.id, course.code, course.name, None)))
+    results.sort(key=lambda result: result[0])
+    return [result for _, result in results[:limit]]
+
+def search_result(kind, ref, label, name, role):
+    if kind == 'course':
+        return {'kind': 'course', 'id': ref, 'code': label, 'name': name}
+    return {'kind': 'user', 'id': ref, 'index_number': label, 'name': name, 'role': role}
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    if not create_search_index():
+        print("Full-text search needs SQLite with FTS5; searches use LIKE instead.")
+        return
+    fill_search_index()
+    db.session.commit()
+    print("Rebuilt the search index.")
+
+# --- Attendance Analytics ---
+# Attendance rates for the analytics API, computed in SQL from the monthly rollups so reports
+# over years of history group a few rows per student, course and month instead of every record.
+# Medical absences are excused: rate = (present + medical) / total * 100.
+# Results are cached per parameter set until the next attendance change.
+ANALYTICS_THRESHOLD = 80.0  # default eligibility threshold, in percent
+ANALYTICS_PAGE_SIZE = 100
+ANALYTICS_MAX_PAGE_SIZE = 1000
+ANALYTICS_RECENT_SESSIONS = 5  # sessions counted by missed_recently in the sessions report
+
+def analytics_params(args):
+    # Validated report parameters from a request's args. Raises ValueError on bad input.
+    params = {}
+    if args.get('course'):
+        course = find_course(args['course'])
+        if course is None:
+            raise ValueError(f"Unknown course {args['course']}")
+        params['course'] = course.id
+    if args.get('student_index'):
+        params['student_index'] = args['student_index'].strip()
+    for name in ['month_from', 'month_to']:
+        if args.get(name):
+            month = datetime.strptime(args[name], '%Y-%m')
+            params[name] = (month.year, month.month)
+    params['threshold'] = float(args.get('threshold', ANALYTICS_THRESHOLD))
+    if not 0 <= params['threshold'] <= 100:
+        raise ValueError('threshold must be between 0 and 100')
+    params['limit'] = min(int(args.get('limit', ANALYTICS_PAGE_SIZE)), ANALYTICS_MAX_PAGE_SIZE)
+    if params['limit'] < 1:
+        raise ValueError('limit must be positive')
+    if args.get('after'):
+        params['after'] = tuple(int(part) for part in args['after'].split(':'))
+    if args.get('semester'):
+        params['semester'] = semester_bounds(semester_start(args['semester']))[0]
+    if args.get('last'):
+        params['last'] = int(args['last'])
+        if params['last'] < 1:
+            raise ValueError('last must be positive')
+    return params
+
+def keyset_cursor(params, size):
+    # The "after" cursor, which must have one part per ordering column
+    if len(params['after']) != size:
+        raise ValueError('malformed cursor')
+    return params['after']
+
+def rollup_conditions(params, by_student=True):
+    # Filters on the rollup rows; by_student=False leaves out the student_index filter
+    conditions = []
+    if 'course' in params:
+        conditions.append(AttendanceRollup.course_id == params['course'])
+    if 'student_index' in params and by_student:
+        conditions.append(AttendanceRollup.student_id == student_id_query(params))
+    if 'month_from' in params:
+        conditions.append(db.tuple_(AttendanceRollup.year, AttendanceRollup.month) >= params['month_from'])
+    if 'month_to' in params:
+        conditions.append(db.tuple_(AttendanceRollup.year, AttendanceRollup.month) <= params['month_to'])
+    return conditions
+
+def student_id_query(params):
+    return db.select(User.id).where(User.index_number == params['student_index']).scalar_subquery()
+
+def attendance_rate(present, absent, medical):
+    # Percentage of sessions attended or excused, NULL when there were none
+    return db.cast(present + medical, db.Float) * 100 / db.func.nullif(present + absent + medical, 0)
+
+def student_rate_query(params):
+    # Per (student, course) totals and rate, with the course average and each student's
+    # rank within the course (1 = lowest rate) computed by window functions
+    present = db.func.sum(AttendanceRollup.present)
+    absent = db.func.sum(AttendanceRollup.absent)
+    medical = db.func.sum(AttendanceRollup.medical)
+    rate = attendance_rate(present, absent, medical)
+    rates = db.select(
+        AttendanceRollup.student_id, AttendanceRollup.course_id,
+        present.label('present'), absent.label('absent'), medical.label('medical'),
+        (present + absent + medical).label('total'), rate.label('rate'),
+        db.func.avg(rate).over(partition_by=AttendanceRollup.course_id).label('course_rate'),
+        db.func.rank().over(partition_by=AttendanceRollup.course_id, order_by=rate).label('rank_in_course'),
+    ).where(*rollup_conditions(params, by_student=False)) \
+        .group_by(AttendanceRollup.student_id, AttendanceRollup.course_id) \
+        .subquery()
+    # The windows have to see every student of the course; only then narrow down to one student
+    stmt = db.select(rates)
+    if 'student_index' in params:
+        stmt = stmt.where(rates.c.student_id == student_id_query(params))
+    return stmt.subquery()
+
+def student_rates(params, below=None):
+    # One keyset page of per-student course rates ordered by (course, student), optionally only
+    # those below a threshold. Returns (rows, next_cursor); the cursor is "<course_id>:<student_id>".
+    rates = student_rate_query(params)
+    stmt = db.select(rates, User.index_number, User.name).join(User, User.id == rates.c.student_id)
+    if below is not None:
+        stmt = stmt.where(rates.c.rate < below)
+    if 'after' in params:
+        stmt = stmt.where(db.tuple_(rates.c.course_id, rates.c.student_id) > keyset_cursor(params, 2))
+    rows = db.session.execute(stmt.order_by(rates.c.course_id, rates.c.student_id).limit(params['limit'] + 1)).all()
+    results = [{
+        'student_index': row.index_number,
+        'name': row.name,
+        'course_id': row.course_id,
+        'course': course_title(row.course_id),
+        'present': row.present,
+        'absent': row.absent,
+        'medical': row.medical,
+        'total': row.total,
+        'rate': round(row.rate, 2) if row.rate is not None else None,
+        'course_rate': round(row.course_rate, 2) if row.course_rate is not None else None,
+        'rank_in_course': row.rank_in_course,
+    } for row in rows[:params['limit']]]
+    next_cursor = f"{rows[params['limit'] - 1].course_id}:{rows[params['limit'] - 1].student_id}" if len(rows) > params['limit'] else None
+    return results, next_cursor
+
+def course_rates(params):
+    # Per-course totals, overall rate, average student rate and how many students are below the threshold
+    rates = student_rate_query(params)
+    rows = db.session.execute(db.select(
+        rates.c.course_id,
+        db.func.count().label('students'),
+        db.func.sum(rates.c.total).label('sessions'),
+        attendance_rate(db.func.sum(rates.c.present), db.func.sum(rates.c.absent), db.func.sum(rates.c.medical)).label('rate'),
+        db.func.avg(rates.c.rate).label('average_student_rate'),
+        db.func.min(rates.c.rate).label('lowest_student_rate'),
+        db.func.sum(db.case((rates.c.rate < params['threshold'], 1), else_=0)).label('below_threshold'),
+    ).group_by(rates.c.course_id).order_by(rates.c.course_id)).all()
+    return [{
+        'course_id': row.course_id,
+        'course': course_title(row.course_id),
+        'students': row.students,
+        'sessions': row.sessions,
+        'rate': round(row.rate, 2) if row.rate is not None else None,
+        'average_student_rate': round(row.average_student_rate, 2) if row.average_student_rate is not None else None,
+        'lowest_student_rate': round(row.lowest_student_rate, 2) if row.lowest_student_rate is not None else None,
+        'below_threshold': row.below_threshold,
+    } for row in rows]
+
+def monthly_rates(params):
+    # One keyset page of per-course monthly rates with the running (cumulative) rate, ordered by
+    # (course, year, month). Returns (rows, next_cursor); the cursor is "<course_id>:<year>:<month>".
+    present = db.func.sum(AttendanceRollup.present)
+    absent = db.func.sum(AttendanceRollup.absent)
+    medical = db.func.sum(AttendanceRollup.medical)
+    running = {'partition_by': AttendanceRollup.course_id, 'order_by': [AttendanceRollup.year, AttendanceRollup.month]}
+    months = db.select(
+        AttendanceRollup.course_id, AttendanceRollup.year, AttendanceRollup.month,
+        present.label('present'), absent.label('absent'), medical.label('medical'),
+        attendance_rate(present, absent, medical).label('rate'),
+        attendance_rate(db.func.sum(present).over(**running), db.func.sum(absent).over(**running),
+                        db.func.sum(medical).over(**running)).label('cumulative_rate'),
+    ).where(*rollup_conditions(params)) \
+        .group_by(AttendanceRollup.course_id, AttendanceRollup.year, AttendanceRollup.month) \
+        .subquery()
+    stmt = db.select(months)
+    if 'after' in params:
+        stmt = stmt.where(db.tuple_(months.c.course_id, months.c.year, months.c.month) > keyset_cursor(params, 3))
+    rows = db.session.execute(stmt.order_by(months.c.course_id, months.c.year, months.c.month).limit(params['limit'] + 1)).all()
+    results = [{
+        'course_id': row.course_id,
+        'course': course_title(row.course_id),
+        'month': f'{row.year}-{row.month:02d}',
+        'present': row.present,
+        'absent': row.absent,
+        'medical': row.medical,
+        'rate': round(row.rate, 2) if row.rate is not None else None,
+        'cumulative_rate': round(row.cumulative_rate, 2) if row.cumulative_rate is not None else None,
+    } for row in rows[:params['limit']]]
+    last = rows[params['limit'] - 1] if len(rows) > params['limit'] else None
+    return results, f'{last.course_id}:{last.year}:{last.month}' if last else None
+
+def analytics_report(name, params, compute):
+    # Serve a report from the cache while no attendance has changed since it was computed
+    key = f"analytics:{name}:{dashboard_cache.version('attendance')}:{json.dumps(params, sort_keys=True)}"
+    report = dashboard_cache.get(key)
+    if report is None:
+        report = compute()
+        dashboard_cache.set(key, report)
+    return report
+
+# --- Attendance Ingestion ---
+# Card readers and QR scanners post attendance events to /api/attendance/events with a
+# per-scanner bearer token. Events are validated against an in-memory roster of students and
+# enrollments and written a batch at a time; each event's ID is recorded in the same transaction
+# as its attendance upsert, so a scanner can resend anything it isn't sure was received.
+INGEST_BATCH_SIZE = 500  # events validated, deduplicated and committed together
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', 2))  # ingestion requests writing at once
+INGEST_QUEUE_TIMEOUT = float(os.environ.get('INGEST_QUEUE_TIMEOUT', 5))  # seconds a request waits for a slot before a 503
+INGEST_RETRY_AFTER = 2  # seconds, sent with every 503
+INGEST_ROSTER_TTL = 60  # seconds before new students and enrollments are picked up
+INGEST_MAX_ERRORS = 100  # rejected events reported per request
+INGEST_EVENT_RETENTION_DAYS = int(os.environ.get('INGEST_EVENT_RETENTION_DAYS', 30))
+ingest_slots = threading.BoundedSemaphore(INGEST_CONCURRENCY)
+ingest_roster_cache = {'loaded_at': None, 'students': {}, 'enrollments': set()}
+ingest_roster_lock = threading.Lock()
+
+def parse_ingest_tokens(value):
+    # "hall-a:token1,hall-b:token2" -> {'hall-a': 'token1', 'hall-b': 'token2'}
+    tokens = {}
+    for pair in (value or '').split(','):
+        source, _, token = pair.strip().partition(':')
+        if source and token:
+            tokens[source] = token
+    return tokens
+
+INGEST_TOKENS = parse_ingest_tokens(os.environ.get('INGEST_TOKENS'))  # scanner name -> bearer token
+
+def ingest_source(authorization):
+    # Name of the scanner whose token is in an Authorization header, or None
+    source = None
+    for name, token in INGEST_TOKENS.items():
+        if hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            source = name
+    return source
+
+def ingest_roster():
+    # Student ids by index number and enrolled (student_id, course_id) pairs, reloaded every INGEST_ROSTER_TTL seconds
+    with ingest_roster_lock:
+        loaded_at = ingest_roster_cache['loaded_at']
+        if loaded_at is None or time.monotonic() - loaded_at > INGEST_ROSTER_TTL:
+            ingest_roster_cache['students'] = dict(db.session.query(User.index_number, User.id).filter(User.role == 'student').all())
+            ingest_roster_cache['enrollments'] = set(db.session.query(StudentCourse.student_id, StudentCourse.course_id).all())
+            ingest_roster_cache['loaded_at'] = time.monotonic()
+        return ingest_roster_cache['students'], ingest_roster_cache['enrollments']
+
+def ingest_event_stream(req):
+    # (line, event) pairs from an NDJSON body, read a line at a time, or from a JSON body holding
+    # one event, a list of events or {"events": [...]}. Raises ValueError on a malformed JSON body;
+    # a malformed NDJSON line is passed on as its raw text and rejected with the other invalid events.
+    if req.mimetype == 'application/x-ndjson':
+        # Buffered: iterating the raw request stream reads it a byte at a time
+        for line, raw in enumerate(io.BufferedReader(req.stream, 65536), start=1):
+            if not raw.strip():
+                continue
+            try:
+                yield line, json.loads(raw)
+            except ValueError:
+                yield line, raw.decode('utf-8', 'replace').strip()
+        return
+
+    data = req.get_json(force=True, silent=True)
+    if isinstance(data, dict):
+        data = data['events'] if 'events' in data else [data]
+    if not isinstance(data, list):
+        raise ValueError('Body must be an event, a list of events or {"events": [...]}')
+    yield from enumerate(data, start=1)
+
+def parse_ingest_event(event, students, enrollments, ranges):
+    # Validate one event against the roster and archived semesters.
+    # Returns (event_id, attendance row); raises ValueError with the reason it was rejected.
+    if not isinstance(event, dict):
+        raise ValueError('Not a JSON object')
+    event_id = event.get('event_id')
+    if not isinstance(event_id, str) or not 0 < len(event_id) <= 64:
+        raise ValueError('event_id must be a string of 1-64 characters')
+    student_idx = str(event.get('student_index') or '').strip()
+    student_id = students.get(student_idx)
+    if student_id is None:
+        raise ValueError(f'Student {student_idx} not found')
+    course = find_course(event.get('course'))
+    if course is None:
+        raise ValueError(f"Unknown course {event.get('course')}")
+    if (student_id, course.id) not in enrollments:
+        raise ValueError(f'Student {student_idx} is not enrolled in {course.code}')
+    try:
+        date_obj = datetime.fromisoformat(str(event.get('timestamp'))).date()
+    except ValueError:
+        raise ValueError(f"Invalid timestamp '{event.get('timestamp')}' (use ISO 8601)")
+    status = event.get('status', 'Present')
+    if status not in ['Present', 'Absent']:
+        raise ValueError(f"Invalid status '{status}' (must be 'Present' or 'Absent')")
+    semester = archived_semester(date_obj, ranges)
+    if semester:
+        raise ValueError(f'Semester {semester} is archived and read-only')
+    return event_id, {'student_id': student_id, 'course_id': course.id, 'status': status, 'date': date_obj}
+
+def ingest_events(source, events, result):
+    # Validate and write one batch of (line, event) pairs from a scanner and commit it.
+    # Events whose ID was already recorded for this scanner are counted as duplicates and skipped;
+    # rejected events are not recorded, so they can be resent once the problem is fixed.
+    valid = validate_ingest_events(events, result)
+    if not valid:
+        return
+    try:
+        write_ingest_events(source, valid, result)
+    except (IntegrityError, ValueError):
+        # The roster or the archived semesters changed after the events were checked (e.g. a student
+        # was removed): check them again against fresh data, so those events are rejected with a reason
+        db.session.rollback()
+        with ingest_roster_lock:
+            ingest_roster_cache['loaded_at'] = None
+        valid = validate_ingest_events([(line, event) for line, event, _ in valid.values()], result)
+        try:
+            write_ingest_events(source, valid, result)
+        except (IntegrityError, ValueError):
+            db.session.rollback()
+            for line, event, _ in valid.values():
+                reject_ingest_event(result, line, event, 'Could not be stored, resend it')
+
+def validate_ingest_events(events, result):
+    # {event_id: (line, event, attendance row)} of the events that pass parse_ingest_event.
+    # Rejected events and repeated IDs are counted in result.
+    students, enrollments = ingest_roster()
+    ranges = archive_ranges()
+    valid = {}
+    for line, event in events:
+        try:
+            event_id, row = parse_ingest_event(event, students, enrollments, ranges)
+        except ValueError as e:
+            reject_ingest_event(result, line, event, str(e))
+            continue
+        if event_id in valid:
+            result['duplicates'] += 1
+        else:
+            valid[event_id] = (line, event, row)
+    return valid
+
+def reject_ingest_event(result, line, event, error):
+    result['rejected'] += 1
+    if len(result['errors']) < INGEST_MAX_ERRORS:
+        result['errors'].append({'line': line, 'event_id': event.get('event_id') if isinstance(event, dict) else None,
+                                 'error': error})
+
+def write_ingest_events(source, valid, result):
+    # Record the IDs of validated events and apply the new ones in one transaction, then commit.
+    # Raises IntegrityError when a student or course has gone, ValueError when a semester was archived.
+    if not valid:
+        return
+    # Only IDs this scanner hasn't sent before come back from the insert; just those events are applied
+    stmt = upsert_insert(IngestEvent).on_conflict_do_nothing(index_elements=['source', 'event_id']).returning(IngestEvent.event_id)
+    received_at = datetime.utcnow()
+    new_events = set(db.session.execute(stmt, [{'source': source, 'event_id': event_id, 'received_at': received_at}
+                                              for event_id in valid]).scalars())
+    upsert_attendance([row for event_id, (_, _, row) in valid.items() if event_id in new_events])
+    db.session.commit()
+    result['accepted'] += len(new_events)
+    result['duplicates'] += len(valid) - len(new_events)
+
+@app.cli.command('prune-ingest-events')
+def prune_ingest_events_command():
+    cutoff = datetime.utcnow() - timedelta(days=INGEST_EVENT_RETENTION_DAYS)
+    removed = db.session.execute(db.delete(IngestEvent).where(IngestEvent.received_at < cutoff)).rowcount
+    db.session.commit()
+    print(f"Removed {removed} event IDs received more than {INGEST_EVENT_RETENTION_DAYS} days ago.")
+
+# --- Database Upgrades ---
+def upgrade_database():
+    # Bring an existing database.db up to the current schema. Every step is idempotent.
+    db.create_all()
+    seed_courses()
+
+    if db.engine.dialect.name == 'sqlite':
+        # The unique index can't be built while duplicates exist. Tables from before the course
+        # catalog still key records by index number, course name and date.
+        if 'course_code' in table_columns('attendance'):
+            relinked, removed = merge_duplicate_attendance('a.student_index, a.course_code, a.date')
+            if removed:
+                print(f"Removed {removed} duplicate attendance records and moved {relinked} medical reports onto the records kept.")
+        converted, relinked = migrate_course_keys()
+        for table, dropped in converted.items():
+            print(f"Converted {table} to integer course and student keys.")
+            if dropped:
+                print(f"Dropped {dropped} {table} rows (missing students, duplicates or unknown statuses).")
+        if relinked:
+            print(f"Moved {relinked} medical reports onto the attendance records kept.")
+
+    # Medical reports outlive their attendance record once it's archived
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text("ALTER TABLE medical_report ALTER COLUMN attendance_id DROP NOT NULL"))
+        db.session.commit()
+
+    # SQLite can't add foreign keys (or constrained columns) to an existing table, so older tables are rebuilt
+    for model in [Attendance, MedicalReport, ImportJob]:
+        if db.engine.dialect.name == 'sqlite' and table_is_outdated(model):
+            rebuild_table(model)
+            print(f"Rebuilt {model.__tablename__} with the current columns and foreign keys.")
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    # Fill the rollup table the first time it's created
+    if AttendanceRollup.query.first() is None and Attendance.query.first() is not None:
+        rebuild_rollups()
+        print("Built attendance rollups.")
+    # ... and the attendance vectors
+    if AttendanceVector.query.first() is None and (Attendance.query.first() or AttendanceArchive.query.first()) is not None:
+        rebuild_vectors()
+        db.session.commit()
+        print("Built attendance vectors.")
+    # ... and the search index (SQLite with FTS5 only)
+    if db.engine.dialect.name == 'sqlite' and not db.inspect(db.engine).has_table('search_index') and create_search_index():
+        print("Built the search index.")
+
+    moved = migrate_medical_documents()
+    if moved:
+        print(f"Moved {moved} medical documents into content-addressed storage.")
+
+    for table, count in find_orphans().items():
+        print(f"Warning: {count} {table} rows point at missing records. Run 'flask --app app check-orphans' for details.")
+
+def merge_duplicate_attendance(key, joins=''):
+    # Delete attendance records that share a key (SQL over attendance a and any joins). Each group
+    # keeps the record a medical report points at (an approved one first), otherwise the oldest,
+    # which is the one the app has always read and updated. Reports on the deleted records are
+    # moved onto the record kept. Returns (reports moved, records deleted).
+    db.session.execute(db.text("CREATE TEMP TABLE attendance_duplicate (id INTEGER PRIMARY KEY, survivor INTEGER NOT NULL)"))
+    db.session.execute(db.text(
+        "INSERT INTO attendance_duplicate (id, survivor) SELECT id, survivor FROM ("
+        f"SELECT a.id, FIRST_VALUE(a.id) OVER (PARTITION BY {key} ORDER BY "
+        "(SELECT MAX(r.approved) FROM medical_report r WHERE r.attendance_id = a.id) DESC, a.id) AS survivor "
+        f"FROM attendance a {joins}) WHERE id != survivor"
+    ))
+    relinked = db.session.execute(db.text(
+        "UPDATE medical_report SET attendance_id = "
+        "(SELECT survivor FROM attendance_duplicate d WHERE d.id = medical_report.attendance_id) "
+        "WHERE attendance_id IN (SELECT id FROM attendance_duplicate)"
+    )).rowcount
+    removed = db.session.execute(db.text("DELETE FROM attendance WHERE id IN (SELECT id FROM attendance_duplicate)")).rowcount
+    db.session.execute(db.text("DROP TABLE attendance_duplicate"))
+    db.session.commit()
+    return relinked, removed
+
+def table_is_outdated(model):
+    # True when a SQLite table is missing columns or foreign keys its model declares,
+    # or still requires a value in a column the model has made optional
+    table = model.__tablename__
+    not_null = {row[1]: row[3] for row in db.session.execute(db.text(f"PRAGMA table_info({table})"))}
+    foreign_keys = db.session.execute(db.text(f"PRAGMA foreign_key_list({table})")).fetchall()
+    return any(c.name not in not_null or (c.nullable and not_null[c.name]) for c in model.__table__.columns) or \
+        len(foreign_keys) < len(model.__table__.foreign_keys)
+
+def rebuild_table(model, copy_select=None):
+    # Recreate a table from its current model definition and copy the rows across, keeping
+    # every column the old and new layouts share. copy_select can instead give a SELECT over
+    # {table}_old returning the model's columns in order. Returns the number of rows copied.
+    table = model.__tablename__
+    db.session.commit()
+    with db.engine.connect() as conn:
+        # Keep other tables' foreign keys pointing at the new table, and don't enforce
+        # constraints on rows while they're moved
+        foreign_keys = conn.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        conn.exec_driver_sql("PRAGMA legacy_alter_table=ON")
+        old_columns = [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")]
+        columns = ', '.join(c.name for c in model.__table__.columns if copy_select or c.name in old_columns)
+        conn.exec_driver_sql(f"ALTER TABLE {table} RENAME TO {table}_old")
+        for (index,) in conn.exec_driver_sql(
+                f"SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='{table}_old' AND sql IS NOT NULL").fetchall():
+            conn.exec_driver_sql(f"DROP INDEX {index}")
+        model.__table__.create(conn)
+        copied = conn.exec_driver_sql(f"INSERT INTO {table} ({columns}) {copy_select or f'SELECT {columns} FROM {table}_old'}").rowcount
+        conn.exec_driver_sql(f"DROP TABLE {table}_old")
+        conn.commit()
+        conn.exec_driver_sql("PRAGMA legacy_alter_table=OFF")
+        conn.exec_driver_sql(f"PRAGMA foreign_keys={foreign_keys}")
+    return copied
+
+def migrate_course_keys():
+    # Convert tables from before the course catalog, which stored index numbers, course titles and
+    # status names on every row, to user ids, course ids and status codes. Unknown course names are
+    # added to the catalog. Only SQLite needs this; other databases were created with the current
+    # schema. Returns ({table: rows dropped} for the converted tables, medical reports moved).
+    old_layout = [model for model in [Attendance, StudentCourse, AttendanceRollup, ImportJob]
+                  if 'course_code' in table_columns(model.__tablename__)]
+    if not old_layout:
+        return {}, 0
+
+    # Map every course name the old rows use to a catalog entry
+    names = set()
+    for model in old_layout:
+        names.update(name for (name,) in db.session.execute(db.text(f"SELECT DISTINCT course_code FROM {model.__tablename__}")))
+    course_map = {}
+    for name in sorted(names):
+        course = find_course(name) or find_course(name.split(' - ')[0])
+        if course is None:
+            code, _, title = name.partition(' - ')
+            new_course = Course(code=code.strip()[:20], name=(title or name).strip()[:150])
+            db.session.add(new_course)
+            db.session.flush()
+            course_map[name] = new_course.id
+        else:
+            course_map[name] = course.id
+    # A regular table, because the rebuilds below run on their own connection
+    db.session.execute(db.text("CREATE TABLE IF NOT EXISTS course_map (name TEXT PRIMARY KEY, course_id INTEGER)"))
+    db.session.execute(db.text("DELETE FROM course_map"))
+    if course_map:  # the old tables may have no rows yet
+        db.session.execute(db.text("INSERT INTO course_map (name, course_id) VALUES (:name, :course_id)"),
+                           [{'name': name, 'course_id': course_id} for name, course_id in course_map.items()])
+    db.session.commit()
+    reload_courses()
+
+    # Records of one student and date under two names of the same course become duplicates
+    relinked = merged = 0
+    if Attendance in old_layout:
+        relinked, merged = merge_duplicate_attendance('a.student_index, m.course_id, a.date',
+                                                 'JOIN course_map m ON m.name = a.course_code')
+
+    import_job_columns = table_columns('import_job')
+    status_codes = ' '.join(f"WHEN '{status}' THEN {code}" for code, status in enumerate(ATTENDANCE_STATUSES, start=1))
+    joins = {
+        # Records of missing students or with unknown statuses are dropped
+        Attendance: (
+            f"SELECT o.id, u.id, m.course_id, o.date, CASE o.status {status_codes} END FROM attendance_old o "
+            "JOIN \"user\" u ON u.index_number = o.student_index JOIN course_map m ON m.name = o.course_code "
+            f"WHERE o.status IN ({', '.join(repr(status) for status in ATTENDANCE_STATUSES)})"
+        ),
+        StudentCourse: (
+            "SELECT o.id, u.id, m.course_id FROM student_course_old o "
+            "JOIN \"user\" u ON u.index_number = o.student_index JOIN course_map m ON m.name = o.course_code"
+        ),
+        # Rollups are rebuilt from the converted attendance
+        AttendanceRollup: "SELECT * FROM attendance_rollup_old WHERE 0",
+        ImportJob: "SELECT " + ', '.join('m.course_id' if c.name == 'course_id' else f'o.{c.name}' if c.name in import_job_columns else 'NULL'
+                                         for c in ImportJob.__table__.columns) +
+                   " FROM import_job_old o JOIN course_map m ON m.name = o.course_code",
+    }
+    dropped = {}
+    for model in old_layout:
+        table = model.__tablename__
+        before = db.session.execute(db.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        copied = rebuild_table(model, joins[model])
+        dropped[table] = 0 if model is AttendanceRollup else before - copied
+    if Attendance in old_layout:
+        dropped['attendance'] += merged
+    db.session.execute(db.text("DROP TABLE course_map"))
+    db.session.commit()
+    return dropped, relinked
+
+def table_columns(table):
+    return {row[1] for row in db.session.execute(db.text(f"PRAGMA table_info({table})"))}
+
+def foreign_key_violations():
+    # (table, rowid, parent table) for each row whose foreign key points at a missing record.
+    # Only SQLite databases can hold such rows; other backends enforced the keys from the start.
+    if db.engine.dialect.name != 'sqlite':
+        return []
+    return [(table, rowid, parent) for table, rowid, parent, _ in db.session.execute(db.text("PRAGMA foreign_key_check"))]
+
+def find_orphans():
+    # Count rows whose foreign keys point at records that no longer exist, per table
+    counts = {}
+    for table, _, _ in foreign_key_violations():
+        counts[table] = counts.get(table, 0) + 1
+    return counts
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    upgrade_database()
+    print("Database upgraded.")
+
+@app.cli.command('check-orphans')
+def check_orphans_command():
+    # List attendance records without a user and medical reports without a user or attendance record
+    orphans = foreign_key_violations()
+    for table, rowid, parent in orphans:
+        print(f"{table} row {rowid}: missing {parent}")
+    print(f"{len(orphans)} orphaned rows found.")
 
 # --- Setup Helper ---
 def create_dummy_data():
     with app.app_context():
-        db.create_all()
+        upgrade_database()
         if not User.query.filter_by(index_number='admin').first():
             # Create Admin
             admin = User(index_number='admin', password=generate_password_hash('admin123'), role='admin', name='System Administrator')
@@ -100,41 +2700,9 @@ def student_dashboard():
     if 'user_id' not in session or session['role'] != 'student':
         return redirect(url_for('login'))
     
-    records = Attendance.query.filter_by(student_index=session['index']).order_by(Attendance.date.desc()).all()
+    data = student_dashboard_data(session['user_id'])
     
-    # Calculate monthly attendance percentage
-    from datetime import datetime as dt
-    current_year = dt.now().year
-    current_month = dt.now().month
-    
-    monthly_stats = {}
-    
-    # Get all unique months from attendance records
-    all_records = Attendance.query.filter_by(student_index=session['index']).all()
-    months_set = set()
-    for record in all_records:
-        months_set.add((record.date.year, record.date.month))
-    
-    for year, month in sorted(months_set, reverse=True):
-        month_records = [r for r in all_records if r.date.year == year and r.date.month == month]
-        
-        present_count = len([r for r in month_records if r.status == 'Present'])
-        absent_count = len([r for r in month_records if r.status == 'Absent'])
-        medical_count = len([r for r in month_records if r.status == 'Medical'])
-        
-        total = len(month_records)
-        percentage = (present_count / total * 100) if total > 0 else 0
-        
-        month_name = dt(year, month, 1).strftime('%B %Y')
-        monthly_stats[month_name] = {
-            'present': present_count,
-            'absent': absent_count,
-            'medical': medical_count,
-            'total': total,
-            'percentage': round(percentage, 2)
-        }
-    
-    return render_template('student_dash.html', records=records, name=session['name'], monthly_stats=monthly_stats)
+    return render_template('student_dash.html', records=data['records'], name=session['name'], monthly_stats=data['monthly_stats'])
 
 @app.route('/admin/dashboard', methods=['GET', 'POST'])
 def admin_dashboard():
@@ -146,16 +2714,21 @@ def admin_dashboard():
     # Attendance marking (for both admin and administrator)
     if request.method == 'POST' and 'student_index' in request.form:
         student_idx = request.form['student_index']
-        course = request.form['course']
+        course = find_course(request.form['course'])
         status = request.form['status']
         date_str = request.form['date']
         date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
         student = User.query.filter_by(index_number=student_idx, role='student').first()
+        archived = archived_semester(date_obj, archive_ranges())
         if not student:
             flash(f'Student {student_idx} not found.', 'danger')
+        elif not course or status not in ['Present', 'Absent']:
+            flash('Please select a valid course and status.', 'danger')
+        elif archived:
+            flash(f'Semester {archived} is archived and read-only.', 'danger')
         else:
-            new_record = Attendance(student_index=student_idx, course_code=course, status=status, date=date_obj)
-            db.session.add(new_record)
+            # Re-marking the same student, course and day corrects the existing record
+            upsert_attendance([{'student_id': student.id, 'course_id': course.id, 'status': status, 'date': date_obj}])
             db.session.commit()
             flash('Attendance marked successfully.', 'success')
     
@@ -177,57 +2750,183 @@ def admin_dashboard():
             index = request.form['remove_index']
             user = User.query.filter_by(index_number=index).first()
             if user:
+                invalidate_students([user.id])
+                # Their medical reports go with them, and so do the references those reports held
+                blob_counts = dict(db.session.query(MedicalReport.blob_id, db.func.count())
+                                   .filter(MedicalReport.student_index == index, MedicalReport.blob_id.isnot(None))
+                                   .group_by(MedicalReport.blob_id).all())
+                release_blobs(blob_counts)
                 db.session.delete(user)
                 db.session.commit()
+                collect_blobs(list(blob_counts))
                 flash('User removed successfully.', 'success')
             else:
                 flash('User not found.', 'danger')
-        # Export attendance
-        if request.method == 'POST' and 'export_attendance' in request.form:
-            import csv
-            from io import StringIO
-            output = StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['Student Index', 'Date', 'Course', 'Status'])
-            for record in Attendance.query.order_by(Attendance.date.desc()).all():
-                writer.writerow([record.student_index, record.date, record.course_code, record.status])
-            output.seek(0)
-            return app.response_class(
-                output.getvalue(),
-                mimetype='text/csv',
-                headers={'Content-Disposition': 'attachment;filename=attendance.csv'}
-            )
     
-    records = Attendance.query.order_by(Attendance.date.desc()).all()
-    users = User.query.order_by(User.role, User.index_number).all()
+    # Record filters come from the query string so they survive paging
+    filters = {key: value for key, value in request.args.items() if key not in PAGINATION_ARGS and value}
+    try:
+        records, next_records = attendance_page(attendance_filters(filters), request.args.get('records_before'))
+    except ValueError:
+        flash('Invalid filter or page (use YYYY-MM-DD for dates).', 'danger')
+        filters = {}
+        records, next_records = attendance_page([])
     
-    # Get pending medical reports
-    medical_reports_pending = MedicalReport.query.filter_by(approved=False).order_by(MedicalReport.date_submitted.desc()).all()
+    users, next_users = [], None
+    if is_administrator:
+        # A search replaces the paged user list with the best matches
+        users_query = request.args.get('users_q', '').strip()
+        if users_query:
+            users = search(users_query, kind='user', limit=USERS_PAGE_SIZE)
+        else:
+            users, next_users = users_page(request.args.get('users_after'))
     
-    # Attach attendance object to each medical report for template access
-    for report in medical_reports_pending:
-        report.attendance_obj = Attendance.query.get(report.attendance_id)
+    # Get pending medical reports together with their attendance records in one query
+    medical_reports_pending = MedicalReport.query.options(db.joinedload(MedicalReport.attendance)) \
+        .filter_by(approved=False).order_by(MedicalReport.date_submitted.desc()).all()
     
     return render_template('admin_dash.html', records=records, users=users, is_administrator=is_administrator, 
-                         medical_reports_pending=medical_reports_pending, name=session['name'])
+                         medical_reports_pending=medical_reports_pending, name=session['name'],
+                         courses=course_catalog(), statuses=ATTENDANCE_STATUSES, filters=filters,
+                         next_records=next_records, next_users=next_users)
+
+@app.route('/admin/search')
+def search_view():
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        return {'error': 'Not authorized'}, 401
+    kind = request.args.get('kind') or None
+    if kind not in (None, 'user', 'course'):
+        return {'error': 'kind must be user or course'}, 400
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return {'error': 'limit must be a number'}, 400
+    query = request.args.get('q', '')
+    return {'query': query, 'results': search(query, kind, request.args.get('role') or None, limit)}
+
+@app.route('/admin/cache-stats')
+def cache_stats_view():
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        return redirect(url_for('login'))
+    requests_served = cache_stats['hits'] + cache_stats['misses']
+    return {
+        'backend': CACHE_BACKEND,
+        'hits': cache_stats['hits'],
+        'misses': cache_stats['misses'],
+        'hit_rate': round(cache_stats['hits'] / requests_served, 4) if requests_served else None,
+        'entries': dashboard_cache.size(),
+    }
+
+@app.route('/metrics')
+def metrics():
+    authorization = request.headers.get('Authorization', '')
+    token_ok = bool(METRICS_TOKEN) and hmac.compare_digest(authorization.encode(), f'Bearer {METRICS_TOKEN}'.encode())
+    if not token_ok and ('user_id' not in session or session['role'] not in ['admin', 'administrator']):
+        return redirect(url_for('login'))
+    return app.response_class(prometheus_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/analytics/<report>')
+def analytics(report):
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        return {'error': 'Not authorized'}, 401
+    
+    try:
+        params = analytics_params(request.args)
+    except ValueError as e:
+        return {'error': f'Invalid parameter: {e}'}, 400
+    
+    if report == 'eligibility':
+        # Students whose rate in a course is below the threshold
+        def compute():
+            results, next_cursor = student_rates(params, below=params['threshold'])
+            return {'threshold': params['threshold'], 'results': results, 'next': next_cursor}
+    elif report == 'students':
+        def compute():
+            results, next_cursor = student_rates(params)
+            return {'results': results, 'next': next_cursor}
+    elif report == 'courses':
+        def compute():
+            return {'threshold': params['threshold'], 'results': course_rates(params)}
+    elif report == 'monthly':
+        def compute():
+            results, next_cursor = monthly_rates(params)
+            return {'results': results, 'next': next_cursor}
+    elif report == 'sessions':
+        # Per-student session statistics for one semester (the current one by default)
+        params.setdefault('semester', semester_bounds(datetime.utcnow().date())[0])
+        def compute():
+            results, next_cursor = semester_session_rates(params)
+            return {'semester': params['semester'], 'threshold': params['threshold'], 'results': results, 'next': next_cursor}
+    else:
+        return {'error': 'Unknown report'}, 404
+    
+    try:
+        return analytics_report(report, params, compute)
+    except ValueError as e:
+        return {'error': f'Invalid parameter: {e}'}, 400
+
+@app.route('/api/attendance/events', methods=['POST'])
+def ingest_attendance_events():
+    source = ingest_source(request.headers.get('Authorization', ''))
+    if source is None:
+        return {'error': 'Not authorized'}, 401
+    
+    # Backpressure: only INGEST_CONCURRENCY requests write at once. The rest wait for a slot
+    # a few seconds at most, then are told when to retry rather than piling up on the database lock.
+    if not ingest_slots.acquire(timeout=INGEST_QUEUE_TIMEOUT):
+        return {'error': 'Ingestion is busy'}, 503, {'Retry-After': str(INGEST_RETRY_AFTER)}
+    result = {'accepted': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+    try:
+        # Each batch is committed as it is read, so a failed request keeps the batches before it;
+        # resending everything is safe because their event IDs are skipped as duplicates.
+        events = ingest_event_stream(request)
+        for batch in iter(lambda: list(itertools.islice(events, INGEST_BATCH_SIZE)), []):
+            ingest_events(source, batch, result)
+    except ValueError as e:
+        db.session.rollback()
+        return dict(result, error=str(e)), 400
+    except OperationalError:
+        db.session.rollback()
+        return dict(result, error='Database is busy'), 503, {'Retry-After': str(INGEST_RETRY_AFTER)}
+    finally:
+        ingest_slots.release()
+    return result
+
+@app.route('/admin/export')
+def export_attendance():
+    if 'user_id' not in session or session['role'] != 'administrator':
+        return redirect(url_for('login'))
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        flash(f'Unsupported export format: {fmt}', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    try:
+        filters = parse_attendance_filters(request.args)
+    except ValueError:
+        flash('Invalid filter (use YYYY-MM-DD for dates).', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    
+    chunks = stream_attendance(filters, fmt)
+    filename = f'attendance.{fmt}'
+    mimetype = EXPORT_FORMATS[fmt]
+    if request.args.get('gzip'):
+        chunks = gzip_stream(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    return app.response_class(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment;filename={filename}'}
+    )
 
 @app.route('/admin/mark-attendance-bulk', methods=['GET', 'POST'])
 def mark_attendance_bulk():
     if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
         return redirect(url_for('login'))
     
-    courses = [
-        'NANO2112 - Mathematics for Nano Science Technology I',
-        'NANO2122 - Fundamentals of Nano-Electronics',
-        'NANO2132 - Digital Electronics',
-        'NANO2142 - Introduction to Software Development',
-        'NANO2151 - Principles of Material Science Engineering',
-        'NANO2162 - Engineering Design & Drawings',
-        'NANO2172 - Physical Chemistry for Nanotechnology',
-        'NANO2182 - Management for Technology',
-        'ETCH2111 - English Language & Communication Skills II',
-        'PDEV2110 - Career Development II'
-    ]
+    courses = course_catalog()
     
     students = []
     selected_course = None
@@ -235,69 +2934,62 @@ def mark_attendance_bulk():
     
     if request.method == 'POST':
         # Get course and date from form (always extract these)
-        selected_course = request.form.get('course')
+        selected_course = find_course(request.form.get('course'))
         selected_date_str = request.form.get('date')
         
         if selected_course and selected_date_str:
             try:
                 selected_date = datetime.strptime(selected_date_str, '%Y-%m-%d').date()
+                archived = archived_semester(selected_date, archive_ranges())
                 
+                if archived:
+                    flash(f'Semester {archived} is archived and read-only.', 'warning')
                 # Handle marking attendance for multiple students
-                if 'mark_attendance' in request.form:
+                elif 'mark_attendance' in request.form:
                     attendance_data = request.form.getlist('attendance[]')
-                    student_indices = request.form.getlist('student_index[]')
+                    student_ids = request.form.getlist('student_id[]', type=int)
                     
-                    if not student_indices or not attendance_data:
+                    if not student_ids or not attendance_data:
                         flash('No students selected.', 'warning')
                     else:
-                        for student_idx, status in zip(student_indices, attendance_data):
-                            if status in ['Present', 'Absent']:
-                                # Check if record already exists
-                                existing = Attendance.query.filter_by(
-                                    student_index=student_idx,
-                                    course_code=selected_course,
-                                    date=selected_date
-                                ).first()
-                                
-                                if existing:
-                                    existing.status = status
-                                else:
-                                    new_record = Attendance(
-                                        student_index=student_idx,
-                                        course_code=selected_course,
-                                        status=status,
-                                        date=selected_date
-                                    )
-                                    db.session.add(new_record)
-                        
+                        # Insert new records and update existing ones in one statement per batch
+                        rows = [
+                            {'student_id': student_id, 'course_id': selected_course.id, 'status': status, 'date': selected_date}
+                            for student_id, status in zip(student_ids, attendance_data)
+                            if status in ['Present', 'Absent']
+                        ]
+                        upsert_attendance(rows)
                         db.session.commit()
-                        flash(f'Attendance marked for {selected_course} on {selected_date}', 'success')
+                        flash(f'Attendance marked for {selected_course.title} on {selected_date}', 'success')
                         students = []  # Clear the students list after marking
                         selected_course = None
                         selected_date = None
                 else:
-                    # Load students for the selected course and date
-                    enrolled_students = StudentCourse.query.filter_by(course_code=selected_course).all()
+                    # Load enrolled students with any existing record for this date in one query
+                    roster = db.session.query(User.id, User.index_number, User.name, Attendance.status) \
+                        .join(StudentCourse, StudentCourse.student_id == User.id) \
+                        .outerjoin(Attendance, db.and_(
+                            Attendance.student_id == User.id,
+                            Attendance.course_id == selected_course.id,
+                            Attendance.date == selected_date,
+                        )) \
+                        .filter(StudentCourse.course_id == selected_course.id, User.role == 'student') \
+                        .order_by(StudentCourse.id) \
+                        .all()
                     
-                    if enrolled_students:
-                        for enrollment in enrolled_students:
-                            student = User.query.filter_by(index_number=enrollment.student_index, role='student').first()
-                            if student:
-                                # Check if attendance already exists for this student on this date and course
-                                existing_attendance = Attendance.query.filter_by(
-                                    student_index=student.index_number,
-                                    course_code=selected_course,
-                                    date=selected_date
-                                ).first()
-                                students.append({
-                                    'index': student.index_number,
-                                    'name': student.name,
-                                    'status': existing_attendance.status if existing_attendance else 'Present',
-                                    'has_record': existing_attendance is not None
-                                })
+                    if roster:
+                        for student_id, index, name, status in roster:
+                            students.append({
+                                'id': student_id,
+                                'index': index,
+                                'name': name,
+                                'status': status if status else 'Present',
+                                'has_record': status is not None
+                            })
                     else:
-                        flash(f'No students enrolled in {selected_course}', 'warning')
+                        flash(f'No students enrolled in {selected_course.title}', 'warning')
             except Exception as e:
+                db.session.rollback()
                 flash(f'Error: {str(e)}', 'danger')
     
     return render_template('mark_attendance_bulk.html', 
@@ -344,7 +3036,7 @@ def bulk_upload():
         return redirect(url_for('login'))
     
     if request.method == 'POST':
-        course = request.form.get('course')
+        course = find_course(request.form.get('course'))
         file = request.files.get('csv_file')
         
         if not course:
@@ -359,92 +3051,122 @@ def bulk_upload():
             flash('Please upload a CSV file.', 'danger')
             return redirect(url_for('bulk_upload'))
         
+        file_path = None
         try:
-            import csv
-            from io import StringIO
-            
-            # Read the CSV file
-            stream = StringIO(file.read().decode('utf8'))
-            reader = csv.DictReader(stream)
+            # Keep a copy of the upload for the background worker (and for resuming it later)
+            file_path = os.path.join(app.config['IMPORT_FOLDER'], f'{uuid.uuid4().hex}.csv')
+            file.save(file_path)
             
-            if not reader.fieldnames or reader.fieldnames != ['student_index', 'date', 'status']:
+            with open(file_path, encoding='utf8', newline='') as f:
+                fieldnames = csv.DictReader(f).fieldnames
+            if not fieldnames or fieldnames != CSV_COLUMNS:
+                os.remove(file_path)
                 flash('CSV must have columns: student_index, date, status', 'danger')
                 return redirect(url_for('bulk_upload'))
             
-            added_count = 0
-            skipped_count = 0
-            errors = []
+            job = ImportJob(course_id=course.id, filename=secure_filename(file.filename), file_path=file_path,
+                            submitted_by=session['index'])
+            db.session.add(job)
+            queue_import_job(job)
             
-            for row_num, row in enumerate(reader, start=2):
-                try:
-                    student_idx = row['student_index'].strip()
-                    date_str = row['date'].strip()
-                    status = row['status'].strip()
-                    
-                    # Validate student exists
-                    student = User.query.filter_by(index_number=student_idx, role='student').first()
-                    if not student:
-                        skipped_count += 1
-                        errors.append(f"Row {row_num}: Student {student_idx} not found")
-                        continue
-                    
-                    # Validate status
-                    if status not in ['Present', 'Absent']:
-                        skipped_count += 1
-                        errors.append(f"Row {row_num}: Invalid status '{status}' (must be 'Present' or 'Absent')")
-                        continue
-                    
-                    # Validate date format
-                    try:
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                    except ValueError:
-                        skipped_count += 1
-                        errors.append(f"Row {row_num}: Invalid date format '{date_str}' (use YYYY-MM-DD)")
-                        continue
-                    
-                    # Check if record already exists
-                    existing = Attendance.query.filter_by(
-                        student_index=student_idx,
-                        course_code=course,
-                        date=date_obj
-                    ).first()
-                    
-                    if existing:
-                        skipped_count += 1
-                        continue
-                    
-                    # Add attendance record
-                    new_record = Attendance(
-                        student_index=student_idx,
-                        course_code=course,
-                        status=status,
-                        date=date_obj
-                    )
-                    db.session.add(new_record)
-                    added_count += 1
-                    
-                except Exception as e:
-                    skipped_count += 1
-                    errors.append(f"Row {row_num}: {str(e)}")
-            
-            db.session.commit()
+            flash(f'Import of {job.filename} started for {course.title}.', 'info')
+            return redirect(url_for('import_job', job_id=job.id))
             
-            flash(f'Uploaded {added_count} records successfully for {course}. Skipped {skipped_count} records.', 'success')
+        except Exception as e:
+            db.session.rollback()
+            # No job will ever read the saved copy
+            if file_path and os.path.exists(file_path) and not ImportJob.query.filter_by(file_path=file_path).first():
+                os.remove(file_path)
+            flash(f'Error processing CSV file: {str(e)}', 'danger')
+        
+        return redirect(url_for('bulk_upload'))
+    
+    jobs = ImportJob.query.order_by(ImportJob.created_at.desc()).limit(10).all()
+    return render_template('bulk_upload.html', jobs=jobs, courses=course_catalog())
+
+@app.route('/admin/import-jobs/<int:job_id>')
+def import_job(job_id):
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        return redirect(url_for('login'))
+    
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        flash('Import job not found.', 'danger')
+        return redirect(url_for('bulk_upload'))
+    return render_template('import_job.html', job=job, errors=json.loads(job.errors),
+                           resumable=bool(job.file_path) and os.path.exists(job.file_path))
+
+@app.route('/admin/import-jobs/<int:job_id>/status')
+def import_job_status(job_id):
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        return {'error': 'Not authorized'}, 401
+    
+    job = db.session.get(ImportJob, job_id)
+    if not job:
+        return {'error': 'Import job not found'}, 404
+    return {
+        'id': job.id,
+        'course': course_title(job.course_id),
+        'filename': job.filename,
+        'status': job.status,
+        'rows_processed': job.rows_processed,
+        'added': job.added,
+        'skipped': job.skipped,
+        'error_count': job.error_count,
+        'errors': json.loads(job.errors),
+        'failure': job.failure,
+    }
+
+@app.route('/admin/import-jobs/<int:job_id>/resume', methods=['POST'])
+def resume_import_job(job_id):
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        return redirect(url_for('login'))
+    
+    job = db.session.get(ImportJob, job_id)
+    if not job or job.status != 'failed':
+        flash('Only failed import jobs can be resumed.', 'danger')
+        return redirect(url_for('bulk_upload'))
+    if not job.file_path or not os.path.exists(job.file_path):
+        flash('The uploaded file for this job is no longer available.', 'danger')
+        return redirect(url_for('import_job', job_id=job.id))
+    
+    queue_import_job(job)
+    flash(f'Resuming import from row {job.rows_processed + 2}.', 'info')
+    return redirect(url_for('import_job', job_id=job.id))
+
+@app.route('/admin/bulk-users', methods=['GET', 'POST'])
+def bulk_users():
+    if 'user_id' not in session or session['role'] != 'administrator':
+        return redirect(url_for('login'))
+    
+    if request.method == 'POST':
+        file = request.files.get('csv_file')
+        
+        if not file or file.filename == '':
+            flash('Please select a CSV file.', 'danger')
+            return redirect(url_for('bulk_users'))
+        
+        if not file.filename.endswith('.csv'):
+            flash('Please upload a CSV file.', 'danger')
+            return redirect(url_for('bulk_users'))
+        
+        try:
+            reader = csv.DictReader(codecs.getreader('utf8')(file.stream))
             
-            if errors and len(errors) <= 10:
-                for error in errors:
-                    flash(error, 'warning')
-            elif errors:
-                flash(f'First 10 errors shown. {len(errors) - 10} more errors found.', 'warning')
-                for error in errors[:10]:
-                    flash(error, 'warning')
+            if not reader.fieldnames or reader.fieldnames != USER_CSV_COLUMNS:
+                flash('CSV must have columns: index_number, name, role, password, courses', 'danger')
+                return redirect(url_for('bulk_users'))
             
+            result = import_users_csv(reader)
+            flash(f"Added {result['added']} users successfully. Skipped {result['skipped']} rows.", 'success')
+            flash_row_errors(result['errors'])
         except Exception as e:
+            db.session.rollback()
             flash(f'Error processing CSV file: {str(e)}', 'danger')
         
-        return redirect(url_for('bulk_upload'))
+        return redirect(url_for('bulk_users'))
     
-    return render_template('bulk_upload.html')
+    return render_template('bulk_users.html', courses=course_catalog())
 
 @app.route('/student/upload-medical', methods=['GET', 'POST'])
 def upload_medical():
@@ -467,7 +3189,7 @@ def upload_medical():
         try:
             # Get the attendance record
             attendance = Attendance.query.get(int(attendance_id))
-            if not attendance or attendance.student_index != session['index'] or attendance.status != 'Absent':
+            if not attendance or attendance.student_id != session['user_id'] or attendance.status != 'Absent':
                 flash('Invalid attendance record.', 'danger')
                 return redirect(url_for('upload_medical'))
             
@@ -477,16 +3199,16 @@ def upload_medical():
                 flash('Medical report already submitted for this absence.', 'warning')
                 return redirect(url_for('upload_medical'))
             
-            # Save the file
-            filename = secure_filename(f"{session['index']}_{attendance_id}_{file.filename}")
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # Save the file (once per distinct content)
+            blob = store_blob(file.stream)
             
             # Create medical report record
             medical_report = MedicalReport(
                 student_index=session['index'],
                 attendance_id=int(attendance_id),
-                document_path=filepath,
+                document_path=blob_path(blob.sha256),
+                document_name=secure_filename(file.filename),
+                blob_id=blob.id,
                 reason=reason
             )
             db.session.add(medical_report)
@@ -496,12 +3218,13 @@ def upload_medical():
             return redirect(url_for('upload_medical'))
             
         except Exception as e:
+            db.session.rollback()
             flash(f'Error uploading medical report: {str(e)}', 'danger')
             return redirect(url_for('upload_medical'))
     
     # Get student's absences that don't have medical reports yet
     student_absences = Attendance.query.filter_by(
-        student_index=session['index'],
+        student_id=session['user_id'],
         status='Absent'
     ).order_by(Attendance.date.desc()).all()
     
@@ -514,29 +3237,51 @@ def upload_medical():
     
     return render_template('upload_medical.html', absences=available_absences, medical_reports=medical_reports)
 
+@app.route('/admin/medical-reports/<int:report_id>/document')
+def medical_document(report_id):
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        return redirect(url_for('login'))
+    
+    report = db.session.get(MedicalReport, report_id)
+    if not report or not report.blob or not os.path.isfile(blob_path(report.blob.sha256)):
+        flash('Medical report document not found.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    
+    # Content never changes for a given hash, so it doubles as a strong ETag. conditional=True
+    # answers If-None-Match with 304 and serves Range requests.
+    name = report.document_name or report.blob.sha256
+    response = send_file(
+        os.path.abspath(blob_path(report.blob.sha256)),
+        mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+        download_name=name,
+        conditional=True,
+        etag=report.blob.sha256,
+    )
+    # Medical documents are personal: only the admin's own browser may keep a copy, and it has to
+    # revalidate it (a cheap 304 thanks to the ETag) so access checks run on every view
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.max_age = 0
+    return response
+
 @app.route('/admin/approve-medical/<int:report_id>', methods=['POST'])
 def approve_medical(report_id):
     if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
         return redirect(url_for('login'))
     
     try:
-        report = MedicalReport.query.get(report_id)
-        if not report:
+        outcome = review_medical_reports([report_id], 'approve', session['index'])[report_id]
+        if outcome == 'not_found':
             flash('Medical report not found.', 'danger')
-            return redirect(url_for('admin_dashboard'))
-        
-        # Update attendance status to Medical
-        attendance = Attendance.query.get(report.attendance_id)
-        if attendance:
-            attendance.status = 'Medical'
-            report.approved = True
-            report.approved_by = session['index']
-            report.approved_date = datetime.utcnow()
-            db.session.commit()
-            flash('Medical report approved. Attendance status updated.', 'success')
-        else:
+        elif outcome == 'no_attendance':
             flash('Associated attendance record not found.', 'danger')
+        elif outcome == 'already_approved':
+            flash('Medical report was already approved.', 'info')
+        else:
+            flash('Medical report approved. Attendance status updated.', 'success')
     except Exception as e:
+        db.session.rollback()
         flash(f'Error approving medical report: {str(e)}', 'danger')
     
     return redirect(url_for('admin_dashboard'))
@@ -547,19 +3292,58 @@ def reject_medical(report_id):
         return redirect(url_for('login'))
     
     try:
-        report = MedicalReport.query.get(report_id)
-        if not report:
+        if review_medical_reports([report_id], 'reject', session['index'])[report_id] == 'not_found':
             flash('Medical report not found.', 'danger')
-            return redirect(url_for('admin_dashboard'))
-        
-        db.session.delete(report)
-        db.session.commit()
-        flash('Medical report rejected.', 'info')
+        else:
+            flash('Medical report rejected.', 'info')
     except Exception as e:
+        db.session.rollback()
         flash(f'Error rejecting medical report: {str(e)}', 'danger')
     
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/medical-reports/review', methods=['POST'])
+def review_medical():
+    # Approve or reject many reports at once: a form post from the dashboard (report_id fields and
+    # an action) redirects back with a summary; a JSON post ({"report_ids": [...], "action": ...})
+    # gets the outcome for every id.
+    if 'user_id' not in session or session['role'] not in ['admin', 'administrator']:
+        if request.is_json:
+            return {'error': 'Not authorized'}, 401
+        return redirect(url_for('login'))
+    
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        report_ids, action = data.get('report_ids'), data.get('action')
+        if not isinstance(report_ids, list) or not all(isinstance(report_id, int) for report_id in report_ids):
+            return {'error': 'report_ids must be a list of integers'}, 400
+    else:
+        report_ids, action = request.form.getlist('report_id', type=int), request.form.get('action')
+    if action not in ['approve', 'reject']:
+        if request.is_json:
+            return {'error': "action must be 'approve' or 'reject'"}, 400
+        flash('Unknown review action.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    
+    try:
+        results = review_medical_reports(report_ids, action, session['index'])
+    except Exception as e:
+        db.session.rollback()
+        if request.is_json:
+            return {'error': str(e)}, 500
+        flash(f'Error reviewing medical reports: {str(e)}', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    
+    summary = Counter(results.values())
+    if request.is_json:
+        return {'results': {str(report_id): outcome for report_id, outcome in results.items()}, 'summary': summary}
+    if not report_ids:
+        flash('No medical reports selected.', 'warning')
+    else:
+        flash(', '.join(f"{count} {outcome.replace('_', ' ')}" for outcome, count in sorted(summary.items())) + '.',
+              'success' if summary.keys() <= {'approved', 'rejected'} else 'warning')
+    return redirect(url_for('admin_dashboard'))
+
 @app.route('/logout')
 def logout():
     session.clear()
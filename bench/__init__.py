@@ -0,0 +1,2 @@
+# Benchmarks for UniTrack's hot routes, driven through the Flask test client against a
+# generated database. Run with: python -m bench.run --help
@@ -0,0 +1,51 @@
+# Compare two bench.run result files and flag regressions.
+#
+#   python -m bench.compare baseline.json current.json --threshold 0.2
+#
+# Exits with status 1 when any benchmark's p50 or p95 latency grew by more than the threshold
+# (as a fraction), or when it started issuing more SQL queries per request.
+import argparse
+import json
+import sys
+
+def compare(baseline, current, threshold):
+    regressions = []
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f'{name:32s} (new)')
+            continue
+        changes = []
+        for stat in ['p50', 'p95']:
+            before, after = old['latency_ms'][stat], new['latency_ms'][stat]
+            change = (after - before) / before if before else 0
+            changes.append(f'{stat} {before:.2f} -> {after:.2f} ms ({change:+.0%})')
+            if change > threshold:
+                regressions.append(f'{name}: {stat} latency {change:+.0%}')
+        if new['queries']['max'] > old['queries']['max']:
+            regressions.append(f"{name}: queries {old['queries']['max']} -> {new['queries']['max']}")
+        changes.append(f"queries {old['queries']['max']} -> {new['queries']['max']}")
+        print(f"{name:32s} {'  '.join(changes)}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two UniTrack benchmark result files.')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed latency growth, e.g. 0.2 for 20%%')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print('\nRegressions:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print('\nNo regressions.')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# Deterministic synthetic university data: students enrolled in the standard courses,
+# a teaching calendar, and attendance with configurable absence and medical rates.
+import io
+import random
+from datetime import date, datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+INSERT_BATCH_SIZE = 5000
+BENCH_PASSWORD = 'bench'
+
+def teaching_days(start, count):
+    # The first `count` weekdays on or after start
+    days = []
+    day = start
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def course_meets(course_number, day):
+    # Each course meets twice a week, on two weekdays fixed by its position in the catalog
+    return day.weekday() in (course_number % 5, (course_number + 2) % 5)
+
+def student_index(number):
+    return f'B{number:05d}'
+
+def generate(unitrack, students=500, days=60, absence_rate=0.15, medical_rate=0.2,
+             pending_reports=200, start=date(2025, 1, 6), seed=42):
+    # Fill an empty UniTrack database. Must be called inside an app context.
+    # medical_rate is the share of absences later excused with an approved medical report (stored
+    # as Medical); pending_reports absences get a report that is still awaiting review.
+    # Returns a summary of what was generated.
+    db = unitrack.db
+    rng = random.Random(seed)
+    unitrack.upgrade_database()
+
+    # One shared hash keeps generation fast; every generated user logs in with BENCH_PASSWORD
+    password = generate_password_hash(BENCH_PASSWORD)
+    indices = [student_index(n) for n in range(1, students + 1)]
+    insert_batches(db, unitrack.User, [
+        {'index_number': index, 'name': f'Student {index}', 'role': 'student', 'password': password}
+        for index in indices
+    ] + [{'index_number': 'bench_admin', 'name': 'Bench Administrator', 'role': 'administrator', 'password': password}])
+    user_ids = dict(db.session.query(unitrack.User.index_number, unitrack.User.id).all())
+    student_ids = [user_ids[index] for index in indices]
+    courses = unitrack.course_catalog()
+    insert_batches(db, unitrack.StudentCourse, [
+        {'student_id': student_id, 'course_id': course.id} for course in courses for student_id in student_ids
+    ])
+
+    calendar = teaching_days(start, days)
+    attendance = []
+    for course_number, course in enumerate(courses):
+        for day in calendar:
+            if not course_meets(course_number, day):
+                continue
+            for student_id in student_ids:
+                if rng.random() >= absence_rate:
+                    status = 'Present'
+                elif rng.random() < medical_rate:
+                    status = 'Medical'
+                else:
+                    status = 'Absent'
+                attendance.append({'student_id': student_id, 'course_id': course.id, 'date': day, 'status': status})
+    insert_batches(db, unitrack.Attendance, attendance)
+
+    # Every Medical record has an approved report and pending_reports absences a pending one,
+    # all pointing at one stored document
+    records = db.session.query(unitrack.Attendance.id, unitrack.Attendance.status, unitrack.User.index_number) \
+        .join(unitrack.User, unitrack.Attendance.student_id == unitrack.User.id) \
+        .filter(unitrack.Attendance.status.in_(['Absent', 'Medical'])).order_by(unitrack.Attendance.id).all()
+    absences = [(attendance_id, index) for attendance_id, status, index in records if status == 'Absent']
+    chosen = rng.sample(absences, min(pending_reports, len(absences)))
+    excused = [(attendance_id, index) for attendance_id, status, index in records if status == 'Medical']
+    if chosen or excused:
+        blob = unitrack.store_blob(io.BytesIO(b'%PDF-1.4 synthetic medical certificate\n'))
+        blob.ref_count = len(chosen) + len(excused)
+        report = {'document_path': unitrack.blob_path(blob.sha256), 'document_name': 'certificate.pdf',
+                  'blob_id': blob.id, 'reason': 'Synthetic'}
+        approved_at = datetime.utcnow()
+        insert_batches(db, unitrack.MedicalReport, [
+            dict(report, student_index=index, attendance_id=attendance_id, approved=False)
+            for attendance_id, index in chosen
+        ] + [
+            dict(report, student_index=index, attendance_id=attendance_id, approved=True,
+                 approved_by='bench_admin', approved_date=approved_at)
+            for attendance_id, index in excused
+        ])
+
+    unitrack.rebuild_rollups()
+    return {
+        'students': students,
+        'courses': len(courses),
+        'teaching_days': len(calendar),
+        'first_day': calendar[0].isoformat() if calendar else None,
+        'last_day': calendar[-1].isoformat() if calendar else None,
+        'attendance_rows': len(attendance),
+        'approved_reports': len(excused),
+        'pending_reports': len(chosen),
+    }
+
+def attendance_csv(indices, first_day, rows):
+    # CSV text for bulk_upload with `rows` new records: every student on consecutive weekdays from first_day
+    lines = ['student_index,date,status']
+    day = first_day
+    while len(lines) <= rows:
+        if day.weekday() < 5:
+            for index in indices:
+                lines.append(f'{index},{day.isoformat()},Present')
+                if len(lines) > rows:
+                    break
+        day += timedelta(days=1)
+    return '\n'.join(lines) + '\n'
+
+def insert_batches(db, model, rows):
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(db.insert(model), rows[start:start + INSERT_BATCH_SIZE])
+    db.session.commit()
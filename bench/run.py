@@ -0,0 +1,194 @@
+# Time UniTrack's hot routes against a generated database and write the results as JSON.
+#
+#   python -m bench.run --students 500 --days 60 --output bench_results.json
+#
+# Each benchmark reports latency percentiles (ms), SQL queries per request and peak Python
+# memory. Compare two result files with: python -m bench.compare old.json new.json
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+def measure(name, func, iterations, counter):
+    # Run func `iterations` times; func may return an (optional) dict of extra facts to record
+    latencies = []
+    queries = []
+    extra = {}
+    tracemalloc.reset_peak()
+    for _ in range(iterations):
+        counter.count = 0
+        started = time.perf_counter()
+        extra = func() or extra
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+    _, peak = tracemalloc.get_traced_memory()
+    result = {
+        'iterations': iterations,
+        'latency_ms': {
+            'min': round(min(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(max(latencies), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+        },
+        'queries': {'min': min(queries), 'max': max(queries)},
+        'peak_memory_mb': round(peak / 1024 / 1024, 3),
+        **extra,
+    }
+    print(f"{name:32s} p50 {result['latency_ms']['p50']:10.2f} ms  p95 {result['latency_ms']['p95']:10.2f} ms  "
+          f"queries {result['queries']['max']:6d}  peak {result['peak_memory_mb']:8.2f} MB")
+    return result
+
+def client_for(unitrack, role, index, user_id):
+    client = unitrack.app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(user_id=user_id, role=role, name=index, index=index)
+    return client
+
+def check(response, expected=200):
+    if response.status_code != expected:
+        raise RuntimeError(f'{response.request.path} returned {response.status_code}')
+    return response
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='unitrack-bench-')
+    os.chdir(workdir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, REPO_ROOT)
+    import app as unitrack
+    from bench import datagen
+
+    from sqlalchemy import event
+
+    tracemalloc.start()
+    with unitrack.app.app_context():
+        started = time.perf_counter()
+        summary = datagen.generate(unitrack, students=args.students, days=args.days, absence_rate=args.absence_rate,
+                                   medical_rate=args.medical_rate, pending_reports=args.pending_reports, seed=args.seed)
+        summary['generation_seconds'] = round(time.perf_counter() - started, 2)
+        counter = QueryCounter()
+        event.listen(unitrack.db.engine, 'before_cursor_execute', counter)
+    print(f"Generated {summary['attendance_rows']} attendance rows for {summary['students']} students "
+          f"in {summary['generation_seconds']}s ({workdir})")
+
+    with unitrack.app.app_context():
+        user_ids = dict(unitrack.db.session.query(unitrack.User.index_number, unitrack.User.id).all())
+        courses = [course.id for course in unitrack.course_catalog()]
+    student = datagen.student_index(1)
+    course = courses[0]
+    last_day = date.fromisoformat(summary['last_day'])
+    class_day = next(d for d in datagen.teaching_days(date.fromisoformat(summary['first_day']), args.days)
+                     if datagen.course_meets(0, d))
+    student_client = client_for(unitrack, 'student', student, user_ids[student])
+    admin_client = client_for(unitrack, 'administrator', 'bench_admin', user_ids['bench_admin'])
+    indices = [datagen.student_index(n) for n in range(1, args.students + 1)]
+    results = {}
+
+    def student_dashboard_cold():
+        unitrack.dashboard_cache.bump(f'student:{user_ids[student]}')
+        check(student_client.get('/student/dashboard'))
+    results['student_dashboard_cold'] = measure('student_dashboard (uncached)', student_dashboard_cold, args.iterations, counter)
+    results['student_dashboard_warm'] = measure(
+        'student_dashboard (cached)', lambda: check(student_client.get('/student/dashboard')) and None, args.iterations, counter)
+
+    results['admin_dashboard'] = measure(
+        'admin_dashboard', lambda: check(admin_client.get('/admin/dashboard')) and None, args.iterations, counter)
+    filtered = f'/admin/dashboard?course={course}&date_from={class_day.isoformat()}&status=Absent'
+    results['admin_dashboard_filtered'] = measure(
+        'admin_dashboard (filtered)', lambda: check(admin_client.get(filtered)) and None, args.iterations, counter)
+
+    roster_form = {'course': course, 'date': class_day.isoformat()}
+    results['mark_attendance_bulk_load'] = measure(
+        'mark_attendance_bulk load', lambda: check(admin_client.post('/admin/mark-attendance-bulk', data=roster_form)) and None,
+        args.iterations, counter)
+    save_form = dict(roster_form, mark_attendance='1', **{
+        'student_id[]': [user_ids[index] for index in indices],
+        'attendance[]': ['Present', 'Absent'] * (len(indices) // 2) + ['Present'] * (len(indices) % 2),
+    })
+    results['mark_attendance_bulk_save'] = measure(
+        'mark_attendance_bulk save', lambda: check(admin_client.post('/admin/mark-attendance-bulk', data=save_form)) and None,
+        args.iterations, counter)
+
+    def export(query=''):
+        def run_export():
+            response = check(admin_client.get('/admin/export' + query))
+            return {'bytes': len(response.get_data())}
+        return run_export
+    results['export_csv'] = measure('export (csv)', export(), args.export_iterations, counter)
+    results['export_ndjson_gzip'] = measure('export (ndjson, gzip)', export('?format=ndjson&gzip=1'), args.export_iterations, counter)
+
+    upload_day = last_day + timedelta(days=1)
+    for size in args.upload_sizes:
+        csv_text = datagen.attendance_csv(indices, upload_day, size)
+        upload_day += timedelta(days=(size // max(1, len(indices))) * 7 // 5 + 3)
+
+        def bulk_upload():
+            response = check(admin_client.post('/admin/bulk-upload', content_type='multipart/form-data', data={
+                'course': courses[1], 'csv_file': (io.BytesIO(csv_text.encode()), f'bench_{size}.csv')}), 302)
+            job_id = int(response.headers['Location'].rstrip('/').split('/')[-1])
+            while True:
+                status = check(admin_client.get(f'/admin/import-jobs/{job_id}/status')).json
+                if status['status'] in ('completed', 'failed'):
+                    break
+                time.sleep(0.02)
+            if status['status'] == 'failed':
+                raise RuntimeError(f"Import job failed: {status['failure']}")
+            return {'rows': size, 'added': status['added'], 'skipped': status['skipped']}
+        results[f'bulk_upload_{size}'] = measure(f'bulk_upload ({size} rows)', bulk_upload, 1, counter)
+
+    tracemalloc.stop()
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': vars(args),
+            'dataset': summary,
+        },
+        'results': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark UniTrack routes against a synthetic database.')
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--days', type=int, default=60, help='teaching days to generate')
+    parser.add_argument('--absence-rate', type=float, default=0.15)
+    parser.add_argument('--medical-rate', type=float, default=0.2, help='share of absences excused as Medical, each with an approved medical report')
+    parser.add_argument('--pending-reports', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--export-iterations', type=int, default=3)
+    parser.add_argument('--upload-sizes', type=lambda value: [int(size) for size in value.split(',') if size],
+                        default=[10000, 100000], help='comma-separated CSV sizes for bulk_upload')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    report = run(args)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+if __name__ == '__main__':
+    main()
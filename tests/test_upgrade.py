@@ -0,0 +1,46 @@
+# Upgrading databases created by earlier versions of the app. Run with: python -m pytest tests
+import os
+import sqlite3
+import sys
+import tempfile
+
+# app reads its database URL and creates its folders on import, so point both at a scratch directory
+workdir = tempfile.mkdtemp(prefix='unitrack-test-')
+os.chdir(workdir)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'database.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as unitrack  # noqa: E402
+
+# The schema a fresh install created before the course catalog, with records keyed by index
+# number and course name
+OLD_LAYOUT = [
+    "CREATE TABLE subject (id INTEGER NOT NULL, code VARCHAR(20) NOT NULL, name VARCHAR(150) NOT NULL, "
+    "lecturer VARCHAR(100) NOT NULL, PRIMARY KEY (id), UNIQUE (code))",
+    "CREATE TABLE user (id INTEGER NOT NULL, index_number VARCHAR(20) NOT NULL, password VARCHAR(150) NOT NULL, "
+    "role VARCHAR(20) NOT NULL, name VARCHAR(100) NOT NULL, PRIMARY KEY (id), UNIQUE (index_number))",
+    "CREATE TABLE attendance (id INTEGER NOT NULL, student_index VARCHAR(20) NOT NULL, course_code VARCHAR(20) NOT NULL, "
+    "date DATE, status VARCHAR(10) NOT NULL, PRIMARY KEY (id))",
+    "CREATE TABLE medical_report (id INTEGER NOT NULL, student_index VARCHAR(20) NOT NULL, attendance_id INTEGER NOT NULL, "
+    "date_submitted DATETIME, document_path VARCHAR(255) NOT NULL, reason TEXT, approved BOOLEAN, "
+    "approved_by VARCHAR(20), approved_date DATETIME, PRIMARY KEY (id))",
+    "CREATE TABLE student_course (id INTEGER NOT NULL, student_index VARCHAR(20) NOT NULL, "
+    "course_code VARCHAR(100) NOT NULL, PRIMARY KEY (id))",
+]
+
+def test_upgrade_empty_old_layout():
+    # A fresh install that never recorded attendance has no course names to map
+    conn = sqlite3.connect(os.path.join(workdir, 'database.db'))
+    for statement in OLD_LAYOUT:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+    with unitrack.app.app_context():
+        unitrack.upgrade_database()
+        unitrack.upgrade_database()  # every step is idempotent
+        assert 'course_code' not in unitrack.table_columns('attendance')
+        assert 'course_code' not in unitrack.table_columns('student_course')
+        assert unitrack.Course.query.count() > 0
+        assert unitrack.Attendance.query.count() == 0
+        assert unitrack.foreign_key_violations() == []